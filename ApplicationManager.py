@@ -5,13 +5,17 @@ import os
 import sys
 import subprocess
 import threading
-import shutil
-import re
+from collections import deque
 from pathlib import Path
 from datetime import datetime
+from OCRengine import ensure_ocr_worker, stop_ocr_worker
+from PipelineRunner import run_pipeline
 
 dirpath = Path(__file__).parent.as_posix()
 
+OUTPUT_FLUSH_MS = 100           # Buffered log / terminal output and progress are drawn at most 10 times a second
+SCROLLBACK_LINES = 5000         # Lines kept in each text area (and in the buffers between flushes), older ones are dropped
+
 class PDFSorterGUI:
     def __init__(self, root):
         self.root = root
@@ -36,9 +40,15 @@ class PDFSorterGUI:
         self.current_progress = 0
         self.terminal_visible = tk.BooleanVar(value=False)
         self.output_visible = tk.BooleanVar(value=False)
+        self.force_ocr = tk.BooleanVar(value=False)      # Ignore the index stored for these PDFs and OCR them again
         self.processing_errors = []
-        self.capture_summary = False
-        self.summary_lines = []
+        self.ocr_worker = None      # Long-lived OCR worker, started on the first sort and kept for the session
+        
+        # Output from the worker threads is buffered here and drawn by flush_output() on the Tk thread
+        self.terminal_buffer = deque(maxlen=SCROLLBACK_LINES)
+        self.log_buffer = deque(maxlen=SCROLLBACK_LINES)
+        self.pending_progress = None    # Latest progress value, every update in between is dropped
+        self.pending_status = None      # Latest status text
         
         # Get the directory where this script is located
         self.script_dir = Path(__file__).parent
@@ -48,6 +58,14 @@ class PDFSorterGUI:
         
         # Create main UI
         self.create_widgets()
+        
+        # Configure text tags for different message types
+        self.output_text.tag_config("info", foreground=self.primary_color)
+        self.output_text.tag_config("success", foreground=self.success_color)
+        self.output_text.tag_config("error", foreground=self.error_color)
+        self.output_text.tag_config("warning", foreground="#f39c12")
+        
+        self.root.after(OUTPUT_FLUSH_MS, self.flush_output)
     
     def create_directories(self):
         """Create necessary directories if they don't exist"""
@@ -55,8 +73,6 @@ class PDFSorterGUI:
             self.script_dir / "ReferenceCSV",
             self.script_dir / "PDFsToProcess",
             self.script_dir / "_workingdata_",
-            self.script_dir / "_workingdata_" / "_bloatedcache_",
-            self.script_dir / "_workingdata_" / "_pdfcache_",
             self.script_dir / "_workingdata_" / "_indexdataset_",
             self.script_dir / "_workingdata_" / "_indexdataset_" / "combined_data",
             self.script_dir / "SortedPDFs"
@@ -105,6 +121,16 @@ class PDFSorterGUI:
         )
         self.browse_btn.pack(side="right", padx=(5, 10), pady=10)
         
+        self.force_ocr_check = tk.Checkbutton(
+            step1_frame,
+            text="Run OCR again (ignore the stored index for these PDFs)",
+            variable=self.force_ocr,
+            font=("Arial", 10),
+            bg="white",
+            activebackground="white"
+        )
+        self.force_ocr_check.pack(anchor="w", padx=10, pady=(0, 5))
+        
         # Step 2: Master Sheet Selection
         step2_frame = self.create_section_frame(main_frame, "Select Master Sheet Source")
         
@@ -381,27 +407,55 @@ class PDFSorterGUI:
             self.airtable_frame.pack_forget()
             
     def log_message(self, message, msg_type="info"):
-        """Log a message to the output text area"""
+        """Queue a message for the output text area (safe from any thread, drawn by flush_output)"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        
-        # Configure text tags for different message types
-        self.output_text.tag_config("info", foreground=self.primary_color)
-        self.output_text.tag_config("success", foreground=self.success_color)
-        self.output_text.tag_config("error", foreground=self.error_color)
-        self.output_text.tag_config("warning", foreground="#f39c12")
-        
-        # Insert message with appropriate tag
-        self.output_text.insert(tk.END, f"[{timestamp}] {message}\n", msg_type)
-        self.output_text.see(tk.END)
-        self.root.update_idletasks()
+        self.log_buffer.append((f"[{timestamp}] {message}\n", msg_type))
     
     def terminal_output(self, message):
-        """Output message to terminal window"""
-        self.terminal_text.config(state="normal")  # Enable for writing
-        self.terminal_text.insert(tk.END, message)
-        self.terminal_text.see(tk.END)
-        self.terminal_text.config(state="disabled")  # Disable after writing
-        self.root.update_idletasks()
+        """Queue a message for the terminal window (safe from any thread, drawn by flush_output)"""
+        self.terminal_buffer.append(message)
+        
+    def flush_output(self):
+        """Draw everything buffered since the last flush in one go, then trim the scrollback (runs on the Tk thread every OUTPUT_FLUSH_MS)"""
+        try:
+            if self.terminal_buffer:
+                lines = []
+                while self.terminal_buffer:
+                    lines.append(self.terminal_buffer.popleft())
+                self.terminal_text.config(state="normal")  # Enable for writing
+                self.terminal_text.insert(tk.END, "".join(lines))
+                self.trim_scrollback(self.terminal_text)
+                self.terminal_text.see(tk.END)
+                self.terminal_text.config(state="disabled")  # Disable after writing
+                
+            if self.log_buffer:
+                while self.log_buffer:
+                    message, msg_type = self.log_buffer.popleft()
+                    self.output_text.insert(tk.END, message, msg_type)    # Insert message with appropriate tag
+                self.trim_scrollback(self.output_text)
+                self.output_text.see(tk.END)
+                
+            if self.pending_progress is not None or self.pending_status is not None:
+                value, status = self.pending_progress, self.pending_status
+                self.pending_progress = self.pending_status = None
+                self.apply_progress(value, status)
+        finally:
+            self.root.after(OUTPUT_FLUSH_MS, self.flush_output)
+            
+    def trim_scrollback(self, text_widget):
+        """Drop the oldest lines of a text area past SCROLLBACK_LINES"""
+        line_count = int(text_widget.index("end-1c").split(".")[0])
+        if line_count > SCROLLBACK_LINES:
+            text_widget.delete("1.0", f"{line_count - SCROLLBACK_LINES + 1}.0")
+            
+    def clear_output(self):
+        """Empty both text areas and anything still waiting in the buffers"""
+        self.terminal_buffer.clear()
+        self.log_buffer.clear()
+        self.output_text.delete(1.0, tk.END)
+        self.terminal_text.config(state="normal")
+        self.terminal_text.delete(1.0, tk.END)
+        self.terminal_text.config(state="disabled")
 
     def show_missing_drawings_warning(self, total_drawings, found_drawings, missing_drawings, missing_list):
         """Show a warning window for missing drawings"""
@@ -522,10 +576,10 @@ class PDFSorterGUI:
         self.sort_btn.config(state="disabled", text="Processing...")
         self.browse_btn.config(state="disabled")
         self.csv_browse_btn.config(state="disabled")
+        self.force_ocr_check.config(state="disabled")
         
         # Clear outputs
-        self.output_text.delete(1.0, tk.END)
-        self.terminal_text.delete(1.0, tk.END)
+        self.clear_output()
         
         # Show terminal if hidden
         if not self.terminal_visible.get():
@@ -537,51 +591,37 @@ class PDFSorterGUI:
         thread.start()
         
     def process_pdfs(self):
-        """Main processing function that runs the Python scripts in sequence"""
+        """Main processing function, runs the pipeline (PipelineRunner.py) and shows what it reports"""
         try:
             # Initial terminal output
             self.terminal_output("Sorting PDFs. . .\n")
             
-            # Copy PDFs to processing directory
-            self.prepare_pdfs()
-            
-            # Prepare reference CSV if needed
-            if self.input_method.get() == "csv":
-                self.prepare_csv()
-            
-            # List of scripts to run with their progress ranges
-            scripts = [
-                ("PDFcombiner.py", 0, 20, "Combining PDFs..."),
-                ("ExpandedPDFdrawingNumberCrop.py", 20, 40, "Cropping drawing numbers..."),
-                ("cropToJPEGcachePDF.py", 40, 60, "Converting to JPEG cache..."),
-                ("CacheOCR.py", 60, 80, "Running OCR..."),
-                (self.get_sorter_script(), 80, 100, "Sorting PDFs...")
-            ]
-            
-            # Track overall success
-            all_successful = True
+            use_airtable = self.input_method.get() == "airtable"
+            report = run_pipeline(
+                self.selected_directory.get(),
+                airtable_url=self.airtable_link.get() if use_airtable else None,
+                csv_path=None if use_airtable else self.csv_file_path.get(),
+                on_output=self.terminal_output,
+                on_event=self.handle_event,
+                on_stage=self.start_stage,
+                before_ocr=self.start_ocr_worker,      # Once per session so back-to-back sorts only load PaddleOCR once
+                job_dir=self.script_dir,       # One sort at a time in the GUI, it keeps the shared layout
+                force_ocr=self.force_ocr.get()
+            )
             
-            # Run each script
-            for script, start_progress, end_progress, status_msg in scripts:
-                self.update_progress(start_progress, status_msg)
-                
-                # Add script separator to terminal
-                separator = "=" * 86
-                self.terminal_output(f"\n{separator}\n")
-                self.terminal_output(f"{script}\n")
-                self.terminal_output(f"{separator}\n\n")
-                
-                success = self.run_script(script, start_progress, end_progress)
-                
-                if not success:
-                    all_successful = False
-                    self.log_message(f"Error running {script}", "error")
-                    self.processing_errors.append(f"Failed to run {script}")
-                    break
+            for stage in report['stages']:
+                if not stage['success']:
+                    self.log_message(f"Error running {stage['script']}", "error")
+                    if stage['returncode'] != 0:
+                        if stage['stderr_tail']:
+                            self.log_message(stage['stderr_tail'][-1], "error")      # Last line of the traceback
+                        self.processing_errors.append(f"{stage['script']} exited with code {stage['returncode']}")
+            if not report['success'] and not self.processing_errors:
+                self.processing_errors.append("No sorted PDF was produced")
             
             # Check for errors collected during processing
-            if self.processing_errors or not all_successful:
-                self.update_progress(self.progress_var.get(), "Error in sorting PDF :(\n[check logs for error codes]")
+            if self.processing_errors:
+                self.update_progress(None, "Error in sorting PDF :(\n[check logs for error codes]")
                 self.log_message("PDF sorting failed due to errors", "error")
                 self.terminal_output("\n\nProcessing failed with errors!\n")
                 self.toggle_terminal()
@@ -593,216 +633,94 @@ class PDFSorterGUI:
                 self.update_progress(100, "Processing complete!")
                 self.log_message("PDF sorting completed successfully!", "success")
                 self.terminal_output("\n\nProcessing complete!\n")
-            
-            # Check if we have missing drawings from the last script
-            if hasattr(self, 'summary_lines') and self.summary_lines:
-                # Parse summary lines
-                total_drawings = 0
-                found_drawings = 0
-                missing_count = 0
-                missing_list = []
-                
-                for line in self.summary_lines:
-                    if "Total drawings from master CSV:" in line:
-                        total_drawings = int(re.search(r':\s*(\d+)', line).group(1))
-                    elif "Found in index CSV:" in line:
-                        found_drawings = int(re.search(r':\s*(\d+)', line).group(1))
-                    elif "Missing from CSV:" in line:
-                        missing_count = int(re.search(r':\s*(\d+)', line).group(1))
-                    elif "Missing drawings:" in line:
-                        # Extract the list of missing drawings
-                        missing_str = line.split("Missing drawings:")[1].strip()
-                        missing_list = [d.strip() for d in missing_str.split(',')]
                 
                 # Show warning if there are missing drawings
-                if missing_count > 0:
+                missing_list = [str(drawing) for drawing in report['missing_drawings']]
+                if missing_list:
                     self.root.after(100, lambda: self.show_missing_drawings_warning(
-                        total_drawings, found_drawings, missing_count, missing_list
+                        report['total_drawings'], report['found_drawings'], len(missing_list), missing_list
                     ))
-
-            Sorted_PDF = [f for f in Path(f"{dirpath}/SortedPDFs/").iterdir() if f.suffix.lower() == '.pdf']
-            shutil.move(Path(Sorted_PDF[0]), Path(f"{directory}/SORTED_combined.pdf"))
-            shutil.rmtree(f"{dirpath}/SortedPDFs/")
             
         except Exception as e:
             self.log_message(f"Processing error: {str(e)}", "error")
             self.terminal_output(f"\n\nERROR: {str(e)}\n")
-            self.update_progress(self.progress_var.get(), "Error in sorting PDF :(\n[check logs for error codes]")
+            self.update_progress(None, "Error in sorting PDF :(\n[check logs for error codes]")
             self.toggle_terminal()
             
         finally:
             # Re-enable controls
             self.root.after(0, self.reset_controls)
             
-    def prepare_pdfs(self):
-        """Copy PDFs from selected directory to PDFsToProcess directory"""
-        source_dir = Path(self.selected_directory.get())
-        dest_dir = self.script_dir / "PDFsToProcess"
-        
-        # Create directory if it doesn't exist
-        dest_dir.mkdir(parents=True, exist_ok=True)
+    def start_stage(self, script, start_progress, end_progress, status):
+        """Progress, status and a terminal separator for the stage about to run"""
+        self.update_progress(start_progress, status)
+        self.log_message(f"Running {script}...", "info")
         
-        # Clear existing files
-        for file in dest_dir.glob("*.pdf"):
-            file.unlink()
+        # Add script separator to terminal
+        separator = "=" * 86
+        self.terminal_output(f"\n{separator}\n")
+        self.terminal_output(f"{script}\n")
+        self.terminal_output(f"{separator}\n\n")
             
-        # Copy PDF files
-        pdf_count = 0
-        for pdf_file in source_dir.glob("*.pdf"):
-            shutil.copy2(pdf_file, dest_dir)
-            pdf_count += 1
-            
-        self.log_message(f"Copied {pdf_count} PDF(s) to processing directory", "info")
-        self.terminal_output(f"Copied {pdf_count} PDF(s) to processing directory\n")
-        
-    def prepare_csv(self):
-        """Copy selected CSV to ReferenceCSV directory"""
-        source_csv = Path(self.csv_file_path.get())
-        dest_dir = self.script_dir / "ReferenceCSV"
-        
-        # Create directory if it doesn't exist
-        dest_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Clear existing files
-        for file in dest_dir.glob("*.csv"):
-            file.unlink()
-            
-        # Copy CSV file
-        shutil.copy2(source_csv, dest_dir / "reference.csv")
-        self.log_message("Copied reference CSV file", "info")
-        self.terminal_output("Copied reference CSV file\n")
-        
-    def get_sorter_script(self):
-        """Determine which sorter script to use based on input method"""
-        if self.input_method.get() == "airtable":
-            # Need to update the Airtable URL in PDFpageSorter.py
-            self.update_airtable_url()
-            return "PDFpageSorter.py"
-        else:
-            return "PDFpageSortercsv.py"
-            
-    def update_airtable_url(self):
-        """Update the Airtable URL in PDFpageSorter.py"""
-        script_path = self.script_dir / "PDFpageSorter.py"
-        
-        # Read the script content
-        with open(script_path, 'r') as f:
-            content = f.read()
-            
-        # Replace the tableurl line
-        new_url = self.airtable_link.get()
-        content = re.sub(
-            r'tableurl = ".*?"',
-            f'tableurl = "{new_url}"',
-            content
-        )
-        
-        # Write back
-        with open(script_path, 'w') as f:
-            f.write(content)
-            
-        self.log_message("Updated Airtable URL", "info")
-        self.terminal_output("Updated Airtable URL\n")
-        
-    def run_script(self, script_name, start_progress, end_progress):
-        """Run a Python script and capture its output"""
+    def start_ocr_worker(self):
+        """Start the persistent OCR worker if it isn't running yet (stages fall back to in-process OCR otherwise)"""
         try:
-            script_path = self.script_dir / script_name
-            self.log_message(f"Running {script_name}...", "info")
-            
-            # Run the script with UTF-8 encoding
-            process = subprocess.Popen(
-                [sys.executable, str(script_path)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-                cwd=str(self.script_dir),
-                encoding='utf-8',
-                errors='replace'  # Replace invalid characters instead of failing
-            )
-            
-            # Track if this script has errors
-            script_has_errors = False
-            
-            # Read output line by line
-            for line in process.stdout:
-                if line:
-                    # Output to terminal
-                    self.terminal_output(line)
-                    
-                    line_stripped = line.strip()
-                    if line_stripped:
-                        # Check for progress indicators in the output
-                        self.parse_script_output(line_stripped, start_progress, end_progress)
-                        
-                        # Check for sorting summary (ADD THIS AFTER line_stripped is defined)
-                        if "--- SORTING SUMMARY ---" in line_stripped:
-                            self.capture_summary = True
-                            self.summary_lines = []
-                        elif hasattr(self, 'capture_summary') and self.capture_summary and line_stripped:
-                            self.summary_lines.append(line_stripped)
-                            if "Missing drawings:" in line_stripped:
-                                self.capture_summary = False
-                        
-                        # Check for various error patterns
-                        if any(error_indicator in line_stripped for error_indicator in [
-                            "ERROR", "Error", "error",
-                            "Traceback", "Exception",
-                            "ValueError", "TypeError", "AttributeError", 
-                            "UnicodeEncodeError", "UnicodeDecodeError",
-                            "raise", "FAIL", "Failed", "failed"
-                        ]):
-                            script_has_errors = True
-                            self.processing_errors.append(f"{script_name}: {line_stripped}")
-                            self.log_message(line_stripped, "error")
-                        elif "WARNING" in line_stripped or "Warning" in line_stripped:
-                            self.log_message(line_stripped, "warning")
-                        elif "SUCCESS" in line_stripped or "Successfully" in line_stripped:
-                            self.log_message(line_stripped, "success")
-                        
-            process.wait()
-            
-            # Check return code and error status
-            if process.returncode != 0 or script_has_errors:
-                self.processing_errors.append(f"{script_name} exited with code {process.returncode}")
-                return False
-                
-            return True
-            
+            self.terminal_output("Connecting to OCR worker. . .\n")
+            process = ensure_ocr_worker()
+            if process is not None:
+                self.ocr_worker = process
+                self.log_message("Started OCR worker (model loaded once for this session)", "info")
         except Exception as e:
-            error_msg = f"Failed to run {script_name}: {str(e)}"
-            self.log_message(error_msg, "error")
-            self.terminal_output(f"\nERROR: {error_msg}\n")
-            self.processing_errors.append(error_msg)
-            return False
-            
-    def parse_script_output(self, line, start_progress, end_progress):
-        """Parse script output for progress updates"""
-        # Look for progress bar updates (format: |████████████████████| 100.0%)
-        progress_match = re.search(r'\|[█\-]+\|\s*(\d+\.?\d*)%', line)
-        if progress_match:
-            script_progress = float(progress_match.group(1))
+            self.log_message(f"OCR worker unavailable, OCR will load in each run: {str(e)}", "warning")
+            
+    def on_close(self):
+        """Shut down the OCR worker together with the window"""
+        if self.ocr_worker is not None:
+            stop_ocr_worker()
+            try:
+                self.ocr_worker.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.ocr_worker.kill()
+        self.root.destroy()
+            
+    def handle_event(self, script_name, start_progress, end_progress, event):
+        """Act on one event from a stage script"""
+        event_type = event['event']
+        
+        if event_type == "progress":
             # Map script progress to overall progress range
-            overall_progress = start_progress + (script_progress / 100) * (end_progress - start_progress)
+            overall_progress = start_progress + (event.get('percent', 0) / 100) * (end_progress - start_progress)
             self.update_progress(overall_progress)
+        elif event_type == "warning":
+            self.log_message(event.get('message', ''), "warning")
+        elif event_type == "error":
+            message = event.get('message', '')
+            self.processing_errors.append(f"{script_name}: {message}")
+            self.log_message(message, "error")
+        elif event_type == "summary":
+            self.log_message(f"{script_name}: {', '.join(f'{key} {value}' for key, value in event.items() if key != 'event')}", "success")
+        # 'page' events (one per indexed page) are there for other consumers, the GUI doesn't need them
             
     def update_progress(self, value, status=None):
-        """Update progress bar and status label"""
-        def update():
+        """Queue a progress bar / status label update, only the latest one is drawn on the next flush"""
+        if value is not None:
+            self.pending_progress = value
+        if status:
+            self.pending_status = status
+            
+    def apply_progress(self, value, status=None):
+        """Update progress bar and status label (Tk thread)"""
+        if value is not None:
             self.progress_var.set(value)
-            if status:
-                self.progress_label.config(text=status)
-                # Change color based on status
-                if "Error" in status or "error" in status:
-                    self.progress_label.config(fg=self.error_color)
-                elif "complete" in status:
-                    self.progress_label.config(fg=self.success_color)
-                else:
-                    self.progress_label.config(fg=self.primary_color)
-                    
-        self.root.after(0, update)
+        if status:
+            self.progress_label.config(text=status)
+            # Change color based on status
+            if "Error" in status or "error" in status:
+                self.progress_label.config(fg=self.error_color)
+            elif "complete" in status:
+                self.progress_label.config(fg=self.success_color)
+            else:
+                self.progress_label.config(fg=self.primary_color)
         
     def reset_controls(self):
         """Reset controls after processing"""
@@ -810,12 +728,14 @@ class PDFSorterGUI:
         self.sort_btn.config(state="normal", text="SORT PDFs")
         self.browse_btn.config(state="normal")
         self.csv_browse_btn.config(state="normal")
+        self.force_ocr_check.config(state="normal")
 
 
 def main():
     """Main function to run the application"""
     root = tk.Tk()
     app = PDFSorterGUI(root)
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
     root.mainloop()
 
 
@@ -1,7 +1,19 @@
 import os
+import re
+import sys
+import csv
+import json
+import hashlib
+import configparser
+import fitz
+from pathlib import Path
 
 """
 This file contains all the functional dependencies being used for the data extraction project.
+
+Stages started by ApplicationManager.py (PDFSORTER_EVENTS set in their environment) also report through emit_event():
+one JSON object per line on stderr, {"event": "progress" | "page" | "warning" | "error" | "summary", ...}.
+stdout stays the human readable log, the GUI only shows it and never has to scrape it.
 """
 
 # ------------------------- Generic Functions -------------------------
@@ -56,6 +68,10 @@ def printProgressBar(iteration, total, prefix='', suffix='', decimals=1, length=
     if iteration >= total:
         return
     
+    emit_progress(iteration + 1, total)
+    if EVENTS_ENABLED:
+        return      # The GUI draws progress from the events, a bar line per page would only flood its terminal
+
     percent = ("{0:." + str(decimals) + "f}").format(100 * ((iteration + 1) / float(total)))
     filledLength = int(length * (iteration + 1) // total)
     bar = fill * filledLength + '-' * (length - filledLength)
@@ -64,6 +80,34 @@ def printProgressBar(iteration, total, prefix='', suffix='', decimals=1, length=
     if iteration == total - 1: 
         print()
 
+EVENTS_ENABLED = bool(os.environ.get('PDFSORTER_EVENTS'))     # Set by ApplicationManager.py for the stages it runs
+last_progress = [None]        # Whole percent of the last progress event, one event per percent instead of one per page
+
+def emit_event(event, **fields):
+    """
+    Writes one machine readable event as a JSON line on stderr (no-op unless PDFSORTER_EVENTS is set)
+
+    Args:
+        event (str): 'progress', 'page', 'warning', 'error' or 'summary'
+        **fields: JSON serializable event data
+    """
+    if not EVENTS_ENABLED:
+        return
+    sys.stderr.write(json.dumps({'event': event, **fields}, default=str) + "\n")
+    sys.stderr.flush()
+
+def emit_progress(done, total):
+    """
+    Progress event for done out of total, only when the whole percent changed
+    """
+    if not EVENTS_ENABLED or total <= 0:
+        return
+    percent = int(100 * done / total)
+    if percent == last_progress[0] and done < total:
+        return
+    last_progress[0] = percent
+    emit_event('progress', done=done, total=total, percent=percent)
+
 def display_time(seconds, granularity=2):
     intervals = (
     ('weeks', 604800),  # 60 * 60 * 24 * 7
@@ -83,4 +127,445 @@ def display_time(seconds, granularity=2):
             result.append("{} {}".format(value, name))
     return ', '.join(result[:granularity])
 
+JOB_ROOT_ENV = 'PDFSORTER_JOB_ROOT'
+
+def job_root():
+    """
+    Working root of the current sort job, PDFsToProcess, ReferenceCSV, _workingdata_ and SortedPDFs live under it
+    PDFSORTER_JOB_ROOT if set (PipelineRunner.py gives every job its own so sorts can run side by side), the script directory otherwise
+    config.ini, the OCR cache and the index store stay next to the scripts, shared by every job
+    """
+    return Path(os.environ.get(JOB_ROOT_ENV) or Path(__file__).parent)
+
+JOB_CPUS_ENV = 'PDFSORTER_JOB_CPUS'
+
+def job_cpu_limit():
+    """
+    Cores the current job was given by JobQueue.py (PDFSORTER_JOB_CPUS), None when it has the machine to itself
+    """
+    try:
+        limit = int(os.environ.get(JOB_CPUS_ENV) or 0)
+    except ValueError:
+        return None
+    return limit if limit > 0 else None
+
+def available_cores():
+    """
+    Number of cores this process may use: its CPU affinity, capped by the job's share (job_cpu_limit())
+    """
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    limit = job_cpu_limit()
+    return min(cores, limit) if limit else cores
+
+def load_settings():
+    """
+    Read the [Settings] section of config.ini (next to this file)
+    Missing keys fall back to the defaults passed into getint/getfloat/getboolean by the caller
+    """
+    config = configparser.ConfigParser(inline_comment_prefixes=('#',))
+    config.read(Path(__file__).parent / "config.ini", encoding='utf-8')
+    if not config.has_section('Settings'):
+        config.add_section('Settings')
+    return config['Settings']
+
+# --------------------------- Page Manifest ---------------------------
+
+PAGE_MANIFEST_PATH = job_root() / "_workingdata_" / "page_manifest.json"
+
+def write_page_manifest(manifest, manifest_path=PAGE_MANIFEST_PATH):
+    """
+    Saves the manifest for the later stages (OCR reads pages through it, the sorters copy pages through it)
+    """
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'files': manifest}, f, indent=2)
+
+def load_page_manifest(manifest_path=PAGE_MANIFEST_PATH):
+    """
+    Reads the manifest PDFcombiner.py wrote, returns None if there isn't one
+    """
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)['files']
+
+def manifest_page_map(manifest):
+    """
+    Global page number -> (source file path, 0-based page index in that file)
+    """
+    page_map = {}
+    for entry in manifest:
+        for page_index in range(entry['page_count']):
+            page_map[entry['first_page'] + page_index] = (entry['path'], page_index)
+    return page_map
+
+def page_runs(page_numbers, page_map):
+    """
+    Coalesces the sorted page order into maximal runs of consecutive pages from the same source file
+    Runs can go forwards or backwards, insert_pdf copies from_page > to_page in reverse order
+
+    Args:
+        page_numbers (list): Global (1-based) page numbers in sorted order (all present in page_map)
+        page_map (dict): Global page number -> (source file path, 0-based page index)
+
+    Returns:
+        list: [(source file path, from_page, to_page), ...]
+    """
+    runs = []
+    for page_num in page_numbers:
+        source_path, page_index = page_map[page_num]
+        if runs:
+            run_path, run_from, run_to = runs[-1]
+            step = run_to - run_from        # 0 for a single page run, else +/- (length - 1)
+            if run_path == source_path and (
+                (step >= 0 and page_index == run_to + 1) or (step <= 0 and page_index == run_to - 1)
+            ):
+                runs[-1] = (run_path, run_from, page_index)
+                continue
+        runs.append((source_path, page_index, page_index))
+    return runs
+
+def write_sorted_pdf(page_numbers, manifest, output_path):
+    """
+    Builds the sorted PDF straight from the original input files, in the order of the global page numbers given
+    All pages from one file with no page repeated: the file is reordered in memory with select() and saved
+    Anything else: every run of consecutive pages is copied with one insert_pdf call instead of one call per page
+    Objects shared inside a file (fonts, title block XObjects) are only copied once, insert_pdf keeps a graft map per source document
+    garbage=3 (merge duplicate objects on save) is NOT used, it took seconds per thousand pages and embedded font subsets rarely match across files anyway
+
+    Args:
+        page_numbers (list): Global (1-based) page numbers in the order they should end up in
+        manifest (list): Page manifest of the input set
+        output_path (Path): Where the sorted PDF is saved
+
+    Returns:
+        int: Number of pages in the sorted PDF
+    """
+    page_map = manifest_page_map(manifest)
+
+    wanted_pages = []
+    for page_num in page_numbers:
+        if page_num not in page_map:
+            print(f"{bcolors.WARNING}WARNING: Page {page_num} doesn't exist in the input PDF(s) (only have {len(page_map)} pages){bcolors.ENDC}")
+            emit_event('warning', message=f"Page {page_num} doesn't exist in the input PDF(s) (only have {len(page_map)} pages)")
+            continue
+        wanted_pages.append(page_num)
+
+    source_paths = {page_map[page_num][0] for page_num in wanted_pages}
+
+    if len(source_paths) == 1 and len(set(wanted_pages)) == len(wanted_pages):
+        # Pure permutation (or subset) of a single file, no page copying at all
+        sorted_doc = fitz.open(source_paths.pop())      # In-memory copy, the input file itself is never written
+        try:
+            sorted_doc.select([page_map[page_num][1] for page_num in wanted_pages])
+            sorted_doc.save(str(output_path), garbage=1, deflate=True)       # Drops the objects only unselected pages used
+        finally:
+            sorted_doc.close()
+        return len(wanted_pages)
+
+    source_docs = {}        # Every input file is opened once, insert_pdf reuses its graft map so shared objects are only copied once per file
+    sorted_doc = fitz.open()
+
+    try:
+        for source_path, from_page, to_page in page_runs(wanted_pages, page_map):
+            if source_path not in source_docs:
+                source_docs[source_path] = fitz.open(source_path)
+
+            sorted_doc.insert_pdf(source_docs[source_path], from_page=from_page, to_page=to_page)
+
+        sorted_doc.save(str(output_path), garbage=1, deflate=True)
+    finally:
+        sorted_doc.close()
+        for source_doc in source_docs.values():
+            source_doc.close()
+
+    return len(wanted_pages)
+
+# --------------------------- Crop Manifest ---------------------------
+
+CROP_MANIFEST_PATH = job_root() / "_workingdata_" / "crop_manifest.json"
+MUPDF_ERROR_PATTERN = re.compile(r'(cannot|rect|code|MuPDF error:|format error:)')        # MuPDF warnings that mean the page is broken, not just untidy
+
+def crop_manifest_page(page_num, clip, rotation, flatten=False):
+    """
+    One page of the crop manifest
+
+    Args:
+        page_num (int): 0-based page number in the source file
+        clip (fitz.Rect): Title block clip in displayed coordinates (what get_pixmap(clip=) takes)
+        rotation (int): Page rotation the clip was computed under
+        flatten (bool): MuPDF reported a critical error on the page, cropToJPEGcachePDF.py rasterizes it whole at 300 DPI and cuts the clip
+                        out of the raster (blank image if even that fails)
+    """
+    return {'page': page_num, 'clip': [round(value, 2) for value in clip], 'rotation': rotation, 'flatten': flatten}
+
+def write_crop_manifest(files, manifest_path=CROP_MANIFEST_PATH):
+    """
+    Saves the crop manifest ExpandedPDFdrawingNumberCrop.py builds, a few dozen bytes per page instead of a cropped copy of every input PDF
+
+    Args:
+        files (list): [{'path', 'name', 'pages': [crop_manifest_page(), ...]}, ...]
+    """
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'files': files}, f, separators=(',', ':'))
+
+def load_crop_manifest(manifest_path=CROP_MANIFEST_PATH):
+    """
+    Reads the crop manifest, returns None if there isn't one
+    """
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)['files']
+
+# ------------------------- Persisted Indexes -------------------------
+
+INDEX_STORE_DIR = Path(__file__).parent / "_indexstore_"       # Survives the _workingdata_ clean up at the end of a sort
+INDEX_FORMAT_VERSION = "1"
+
+INDEX_SETTINGS = ('ocr_dpi', 'ocr_dpi_ladder', 'ocr_min_score', 'render_profile',
+                  'text_layer_fast_path', 'title_block_locator', 'title_block_learn_pages')      # config.ini keys that change what TitleBlockOCR.py reads
+
+def index_settings_tag(settings):
+    """
+    The OCR settings a drawing number index was built with, as one string for fingerprint_pdf_set()
+    """
+    return '|'.join(f"{key}={settings.get(key, '').strip().lower()}" for key in INDEX_SETTINGS)
+
+def fingerprint_pdf_set(pdf_paths, ocr_tag=""):
+    """
+    Content fingerprint of a set of input PDFs, in the order the page manifest lays them out (sorted by name)
+    Same names + same bytes + same OCR settings and engine = same fingerprint, so a stored drawing number index for it is still valid
+
+    Args:
+        pdf_paths (list): Paths of the input PDFs
+        ocr_tag (str): OCR settings and engine version the index was built with (index_settings_tag() + ocr_engine_version())
+    """
+    sha = hashlib.sha256(f"index-v{INDEX_FORMAT_VERSION}|{ocr_tag}".encode())
+    for pdf_path in sorted(pdf_paths, key=lambda path: Path(path).name):
+        pdf_path = Path(pdf_path)
+        sha.update(f"|{pdf_path.name}|{pdf_path.stat().st_size}|".encode('utf-8'))
+        with open(pdf_path, 'rb') as f:
+            sha.update(hashlib.file_digest(f, 'sha256').digest())
+    return sha.hexdigest()
+
+def stored_index_path(fingerprint):
+    """
+    Where the combined drawing number index of an input set with this fingerprint is kept between runs
+    """
+    return INDEX_STORE_DIR / fingerprint / "combined_drawing_numbers_dataset.csv"
+
+# ------------------------ Drawing Number Regex -----------------------
+
+drawing_no_pattern = re.compile(r'(?:DRAWING|RAWING|AWING)\s*NO[:.]\s*([A-Z]+[0-9Oo]?(?:\.[0-9Oo]+[A-Z]?)+[^\s]*)')     # Regex pattern to find drawing numbers after "DRAWING NO: " with pattern AG.021.02.15.2A, capturing from start till blankspace
+drawing_no_to_no = re.compile(r'(?:DRAWING|RAWING|AWING)\s*NO[:.]\s*.*?([A-Z]+[0-9Oo]*(?:\.[0-9Oo]+[A-Z]?)+)')          # Regex pattern to find drawing numbers after "DRAWING NO: " with pattern AG01.021.0.13.2A, capturing from start till blankspace
+no_pattern = re.compile(r'[A-Z]+[0-9]+\.[0-9]+[A-Z]?')                                                                  # Regex pattern to find only drawing numbers with pattern AG023.295A
+sheet_no_pattern = re.compile(r'(?:SHEET|HEET|EET)\s*NO[:.]\s*.*?([A-Z]+\-[0-9Oo]+\.[0-9Oo]+[-_]?)')                     # Regex pattern to find sheet numbers after "SHEET NO. ag _sh2glkha sghlka" with pattern AG02.91-
+QF_drawing_no_pattern = re.compile(r'(?:DRAWING|RAWING|AWING)\s*NO[:.]\s*.*?([A-Z]+[0-9Oo]+\-[0-9Oo]+[A-Z]?)')          # Regex pattern to find drawing numbers after "DRAWING NO: " with pattern AB01-02A
+
+DATASET_FIELDNAMES = ['pdf_name', 'page_number', 'drawing_number', 'A_or_G']
+
+def extract_drawing_number(ocr_text):
+    """
+    Runs the drawing number regex cascade over the text of one title block
+
+    Args:
+        ocr_text (str): All recognized text of the title block joined into one string
+
+    Returns:
+        str | None: The cleaned up drawing number, or None if no pattern matched
+    """
+    drawing_number = None
+
+    # Try drawing_no_pattern first (general DRAWING NO: pattern)
+    match = drawing_no_pattern.search(ocr_text)
+    if match:
+        drawing_number = match.group(1)
+
+    # If not found, try drawing_no_to_no (handles complex cases like "DRAWING NO: 8 A7.01")
+    if not drawing_number:
+        match = drawing_no_to_no.search(ocr_text)
+        if match:
+            drawing_number = match.group(1).strip()
+
+    # If still not found, try no_pattern (standalone pattern like "A4.04")
+    if not drawing_number:
+        match = no_pattern.search(ocr_text)
+        if match:
+            drawing_number = match.group(0)
+
+    if not drawing_number:
+        match = sheet_no_pattern.search(ocr_text)
+        if match:
+            drawing_number = match.group(1)
+
+    if not drawing_number:
+        match = QF_drawing_no_pattern.search(ocr_text)
+        if match:
+            drawing_number = match.group(1)
+
+    if not drawing_number:
+        return None
+
+    # Clean up common OCR errors
+    drawing_number = drawing_number.strip()
+    drawing_number = re.sub(r'[Oo]', '0', drawing_number)
+    return drawing_number
+
+def dataset_row(pdf_name, page_number, drawing_number):
+    """
+    Builds one row of the drawing number index dataset (page_number is 1-based)
+    """
+    return {
+        'pdf_name': pdf_name,
+        'page_number': page_number,
+        'drawing_number': drawing_number,
+        'A_or_G': bool(drawing_number) and drawing_number[0].upper() in ['A', 'G']     # Check if it's an A or G drawing
+    }
+
+def ocr_dataset_row(key, ocr_data):
+    """
+    Turns the OCR output of one title block into its index dataset row
+
+    Args:
+        key (tuple): (pdf_name, page_number) the crop was queued with
+        ocr_data (dict | None): {'rec_texts': [...], 'rec_scores': [...]} or None if OCR failed
+    """
+    drawing_number = None
+    if ocr_data:
+        ocr_text = ' '.join(ocr_data.get('rec_texts', []))        # Join all text pieces into a single string
+        drawing_number = extract_drawing_number(ocr_text)
+    return dataset_row(key[0], key[1], drawing_number)
+
+def ocr_drawing_number_score(ocr_data):
+    """
+    Drawing number read from one title block and how sure the OCR engine was about it
+
+    Args:
+        ocr_data (dict | None): {'rec_texts': [...], 'rec_scores': [...]} or None if OCR failed
+
+    Returns:
+        tuple: (drawing_number or None, lowest rec_score of the text pieces the number was read from, 0.0 if there are none)
+    """
+    if not ocr_data:
+        return None, 0.0
+
+    rec_texts = ocr_data.get('rec_texts', [])
+    drawing_number = extract_drawing_number(' '.join(rec_texts))
+    if not drawing_number:
+        return None, 0.0
+
+    scores = []
+    for text, score in zip(rec_texts, ocr_data.get('rec_scores', [])):
+        piece = re.sub(r'[Oo]', '0', text.strip())         # Same clean up extract_drawing_number() does
+        if len(piece) >= 2 and (drawing_number in piece or piece in drawing_number):
+            scores.append(float(score))
+    return drawing_number, min(scores, default=0.0)
+
+def write_dataset_csv(csv_path, rows):
+    """
+    Writes index dataset rows to a csv (header is only written if there are rows, same as before)
+    """
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+        if rows:
+            writer = csv.DictWriter(csvfile, fieldnames=DATASET_FIELDNAMES)
+            writer.writeheader()
+            writer.writerows(rows)
+
+def normalize_drawing_number(drawing_number):
+    """
+    Key drawing numbers are matched on, so " a1.01" from a reference list finds "A1.01" in the index
+    """
+    return str(drawing_number or '').strip().upper()
+
+def load_drawing_index(csv_path):
+    """
+    Loads the combined index dataset once into a dict for O(1) lookups while sorting
+
+    Args:
+        csv_path (Path): combined_drawing_numbers_dataset.csv
+
+    Returns:
+        dict: normalized drawing number -> [page_number, ...] in dataset order (more than one page can carry the same number)
+    """
+    drawing_index = {}
+    with open(csv_path, 'r', newline='', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile, fieldnames=DATASET_FIELDNAMES)
+
+        next(reader, None)      # Skip the header row if it exists
+
+        for row in reader:
+            drawing_number = normalize_drawing_number(row['drawing_number'])
+            if drawing_number:          # Pages without a drawing number can't be matched anyway
+                drawing_index.setdefault(drawing_number, []).append(int(row['page_number']))
+    return drawing_index
+
+# ------------------------- Title Block Crop --------------------------
+
+def displayed_mediabox(page):
+    """
+    Mediabox the way the page is displayed, x and y swap on pages rotated by 90 / 270 degrees
+    (the mediabox page.remove_rotation() used to leave behind, without rewriting the page's content stream)
+
+    Args:
+        page (fitz.Page): PyMuPDF page object
+    """
+    mediabox = page.mediabox
+    if page.rotation % 180:
+        return fitz.Rect(mediabox.y0, mediabox.x0, mediabox.y1, mediabox.x1)
+    return mediabox
+
+def title_block_rect(page):
+    """
+    Returns the rect of the page that holds the DRAWING NO: title block (bottom right corner as displayed)
+    Same fractions of the mediabox that ExpandedPDFdrawingNumberCrop.py has always cropped to
+
+    Args:
+        page (fitz.Page): PyMuPDF page object, rotation left as is
+
+    Returns:
+        fitz.Rect: Crop coordinates for drawing title of the page, in displayed (rotated) coordinates like get_pixmap(clip=) takes
+    """
+    page_mediabox = displayed_mediabox(page)       # Get the MEDIABOX (actual page boundaries)
+
+    if page_mediabox.x0 < 0 and page_mediabox.y0 < 0:
+        # Calculate crop coordinates based on (0,0) center
+        # we start x from the middle, but height from the top downwards
+        width = page_mediabox.width
+        height = page_mediabox.height
+        return fitz.Rect((width * 0.5) * 0.80, height * 0.90, (width * 0.5) * 0.99, height * 0.99)
+
+    # is rotated, x changes height and y changes length
+    x1 = page_mediabox.x1
+    y1 = page_mediabox.y1
+    return fitz.Rect(x1 * 0.85, y1 * 0.85, x1 * 0.99, y1 * 0.99)
+
+def unrotated_clip(page, clip):
+    """
+    Displayed (rotated) clip -> the unrotated coordinates the text layer, search_for() and set_cropbox() work in
+
+    Args:
+        page (fitz.Page): PyMuPDF page object
+        clip (fitz.Rect): Rect in displayed coordinates
+    """
+    return clip * page.derotation_matrix
+
+def title_block_text(page, clip=None):
+    """
+    Reads the title block straight from the PDF's text layer (CAD exports have one, scans don't)
+    Whitespace is collapsed and the text upper-cased so it looks like the joined OCR texts the regex cascade was written for
+
+    Args:
+        page (fitz.Page): PyMuPDF page object, rotation left as is
+        clip (fitz.Rect): Area to read in displayed coordinates, defaults to title_block_rect(page)
+    """
+    if clip is None:
+        clip = title_block_rect(page)
+    return ' '.join(page.get_text("text", clip=unrotated_clip(page, clip)).split()).upper()
+
 # -------------------------------- END --------------------------------
\ No newline at end of file
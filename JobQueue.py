@@ -0,0 +1,398 @@
+import os
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+import json
+import time
+import sqlite3
+import argparse
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from DEdependencies import bcolors
+from DEdependencies import format_bytes
+from DEdependencies import display_time
+from DEdependencies import load_settings
+from DEdependencies import JOB_CPUS_ENV
+
+"""
+Local job queue for sort jobs, so PDFsorter can run as a shared service instead of one person at a time clicking SORT PDFs.
+Jobs live in SQLite (_jobqueue_/jobs.sqlite3), anyone on the machine can submit, and one scheduler process runs them:
+
+    python JobQueue.py submit path/to/pdfs --csv reference.csv [--output DIR]
+    python JobQueue.py submit path/to/pdfs --airtable URL
+    python JobQueue.py run [--once]         # Scheduler, --once exits when the queue is empty
+    python JobQueue.py status [--all]
+    python JobQueue.py retry <job id>
+
+Every job is a PipelineRunner.py CLI run in its own job root (see DEdependencies.job_root()), so jobs never share working files.
+The scheduler starts queued jobs smallest input first while they fit the budget: job_cpu_budget cores and job_memory_budget_mb,
+each job counted as job_cpus cores and job_memory_mb (a job that is bigger than the whole budget still runs, alone).
+The core count isn't only bookkeeping: every job gets PDFSORTER_JOB_CPUS, which the OCR pool and render_workers size themselves to,
+and where the OS allows it the job is pinned to its own job_cpus cores, so N jobs never start N machine-sized OCR pools.
+A failed job goes back in the queue until it has had job_max_attempts tries. The retry doesn't start from scratch:
+if the OCR stage got through, its index was stored (_indexstore_) and the retry only re-runs the manifest and the sorter.
+Only one scheduler runs per queue: it holds an OS file lock next to the database (dropped by the OS when the process dies), a second
+`run` exits instead of starting the first one's jobs again. A scheduler that dies leaves its jobs 'running', the next one puts them back in the queue.
+"""
+
+settings = load_settings()
+
+JOB_QUEUE_DIR = Path(__file__).parent / "_jobqueue_"
+JOB_QUEUE_PATH = JOB_QUEUE_DIR / "jobs.sqlite3"
+JOB_REPORT_DIR = JOB_QUEUE_DIR / "reports"
+JOB_CPUS = settings.getint('job_cpus', 2)       # Cores one sort job gets (PDFSORTER_JOB_CPUS)
+JOB_MEMORY_MB = settings.getint('job_memory_mb', 1500)      # Memory one sort job is counted as using (PaddleOCR + rendering)
+JOB_MAX_ATTEMPTS = settings.getint('job_max_attempts', 2)
+JOB_POLL_SECONDS = 1.0
+
+# ------------------------- Custom Functions --------------------------
+
+def cpu_budget():
+    """
+    Cores the scheduler may hand out, job_cpu_budget or every core of the machine (0)
+    """
+    budget = settings.getint('job_cpu_budget', 0)
+    if budget > 0:
+        return budget
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+def memory_budget_mb():
+    """
+    Memory the scheduler may hand out, job_memory_budget_mb or 75% of physical memory (0)
+    """
+    budget = settings.getint('job_memory_budget_mb', 0)
+    if budget > 0:
+        return budget
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024 * 1024) * 0.75)
+    except (ValueError, OSError, AttributeError):
+        return 8192         # No sysconf (Windows), assume a modest box
+
+def input_size(input_dir):
+    """
+    Bytes of the PDFs in an input directory, what jobs are ordered by
+    """
+    return sum(pdf_file.stat().st_size for pdf_file in Path(input_dir).glob("*.pdf"))
+
+class JobQueue:
+    """
+    SQLite-backed queue of sort jobs
+    """
+    def __init__(self, path=JOB_QUEUE_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+
+        self.conn = sqlite3.connect(str(path), timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")        # Submitting and status checks don't block the scheduler
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                input_dir TEXT NOT NULL,
+                airtable_url TEXT,
+                csv_path TEXT,
+                output_dir TEXT,
+                size_bytes INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                submitted REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                returncode INTEGER,
+                report_path TEXT,
+                error TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_size ON jobs (status, size_bytes)")
+        self.conn.commit()
+
+    def submit(self, input_dir, airtable_url=None, csv_path=None, output_dir=None, max_attempts=JOB_MAX_ATTEMPTS):
+        """
+        Queues a sort job, returns its id
+        """
+        input_dir = Path(input_dir).resolve()
+        cursor = self.conn.execute(
+            "INSERT INTO jobs (input_dir, airtable_url, csv_path, output_dir, size_bytes, status, max_attempts, submitted) "
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (str(input_dir), airtable_url, str(Path(csv_path).resolve()) if csv_path else None,
+             str(Path(output_dir).resolve()) if output_dir else None, input_size(input_dir), max_attempts, time.time())
+        )
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def jobs(self, statuses=None):
+        """
+        Jobs with one of the given statuses (all if None), oldest first
+        """
+        if statuses:
+            return self.conn.execute(
+                f"SELECT * FROM jobs WHERE status IN ({','.join('?' * len(statuses))}) ORDER BY id", list(statuses)
+            ).fetchall()
+        return self.conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+
+    def next_queued(self):
+        """
+        Queued jobs, smallest input first
+        """
+        return self.conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY size_bytes, id").fetchall()
+
+    def mark_running(self, job_id):
+        self.conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started = ?, finished = NULL WHERE id = ?",
+                          (time.time(), job_id))
+        self.conn.commit()
+
+    def mark_finished(self, job_id, returncode, report_path, error=None):
+        """
+        Records how a run ended, failed jobs go back in the queue while they have attempts left
+        """
+        job = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if returncode == 0:
+            status = 'done'
+        elif job['attempts'] < job['max_attempts']:
+            status = 'queued'
+        else:
+            status = 'failed'
+        self.conn.execute("UPDATE jobs SET status = ?, finished = ?, returncode = ?, report_path = ?, error = ? WHERE id = ?",
+                          (status, time.time(), returncode, str(report_path), error, job_id))
+        self.conn.commit()
+        return status
+
+    def retry(self, job_id):
+        """
+        Puts a failed job back in the queue with a fresh set of attempts, returns False if there is no such failed job
+        """
+        cursor = self.conn.execute("UPDATE jobs SET status = 'queued', attempts = 0, error = NULL WHERE id = ? AND status = 'failed'", (job_id,))
+        self.conn.commit()
+        return cursor.rowcount > 0
+
+    def requeue_orphans(self):
+        """
+        Jobs a dead scheduler left 'running' go back in the queue, returns how many (only call it holding the scheduler lock)
+        """
+        cursor = self.conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        self.conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self.conn.close()
+
+def acquire_scheduler_lock(queue):
+    """
+    Exclusive lock on the queue only one scheduler can hold, the OS releases it when the process dies however it dies
+
+    Returns:
+        file: The open lock file (close it to release), None if another scheduler holds the lock
+    """
+    lock_file = open(queue.path.with_suffix('.lock'), 'a+')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{os.getpid()}\n")      # For whoever wonders which process holds it
+    lock_file.flush()
+    return lock_file
+
+def job_command(job, report_path):
+    """
+    PipelineRunner.py command line of a job
+    """
+    command = [sys.executable, str(Path(__file__).parent / "PipelineRunner.py"), job['input_dir'], "--report", str(report_path), "--quiet"]
+    if job['airtable_url']:
+        command += ["--airtable", job['airtable_url']]
+    else:
+        command += ["--csv", job['csv_path']]
+    if job['output_dir']:
+        command += ["--output", job['output_dir']]
+    return command
+
+def job_error(report_path):
+    """
+    First error of a failed run from its report, for the status listing
+    """
+    try:
+        with open(report_path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return "No run report (PipelineRunner.py crashed before writing it)"
+    for stage in report.get('stages', []):
+        if not stage['success']:
+            details = stage['errors'] or stage['stderr_tail'][-1:] or [f"exit code {stage['returncode']}"]
+            return f"{stage['script']}: {details[0]}"
+    return "No sorted PDF was produced"
+
+def run_scheduler(queue, once=False):
+    """
+    Starts queued jobs, smallest first, while they fit the CPU / memory budget, and records how they end
+
+    Args:
+        queue (JobQueue): The job queue
+        once (bool): Return when nothing is queued or running anymore instead of waiting for new jobs
+
+    Returns:
+        bool: False if another scheduler already runs this queue
+    """
+    lock_file = acquire_scheduler_lock(queue)
+    if lock_file is None:
+        print(f"{bcolors.FAIL}Another scheduler is already running this queue ({queue.path.with_suffix('.lock').name}){bcolors.ENDC}")
+        return False
+
+    try:
+        run_jobs(queue, once)
+    finally:
+        lock_file.close()
+    return True
+
+def run_jobs(queue, once=False):
+    """
+    Scheduler loop of run_scheduler(), runs holding the scheduler lock
+    """
+    total_cpus, total_memory = cpu_budget(), memory_budget_mb()
+    running = {}        # job id -> (Popen, report path, log file, pinned core ids)
+
+    # Core ids no running job is pinned to, None where jobs can't be pinned (no sched_setaffinity,
+    # or a budget that oversubscribes the machine on purpose): their share is then only PDFSORTER_JOB_CPUS
+    free_cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_setaffinity') else None
+    if free_cores is not None and total_cpus > len(free_cores):
+        free_cores = None
+
+    orphans = queue.requeue_orphans()
+    if orphans:
+        print(f"{bcolors.WARNING}Put {orphans} job(s) left running by an earlier scheduler back in the queue{bcolors.ENDC}")
+    print(f"Scheduler budget: {total_cpus} core(s) | {total_memory} MB | {JOB_CPUS} core(s) and {JOB_MEMORY_MB} MB per job")
+
+    while True:
+        # Reap finished jobs
+        for job_id, (process, report_path, log_file, cores) in list(running.items()):
+            returncode = process.poll()
+            if returncode is None:
+                continue
+            log_file.close()
+            del running[job_id]
+            if cores:
+                free_cores = sorted(free_cores + cores)
+            error = None if returncode == 0 else job_error(report_path)
+            status = queue.mark_finished(job_id, returncode, report_path, error)
+            color = bcolors.OKGREEN if status == 'done' else bcolors.WARNING if status == 'queued' else bcolors.FAIL
+            print(f"{color}[{datetime.now():%H:%M:%S}] Job {job_id} {'done' if status == 'done' else 'failed'}{' (queued for retry)' if status == 'queued' else ''}{': ' + error if error else ''}{bcolors.ENDC}")
+
+        # Start what fits, smallest input first
+        for job in queue.next_queued():
+            used_cpus, used_memory = len(running) * JOB_CPUS, len(running) * JOB_MEMORY_MB
+            if running and (used_cpus + JOB_CPUS > total_cpus or used_memory + JOB_MEMORY_MB > total_memory):
+                break       # Smallest first, if this one has to wait so do the bigger ones
+
+            queue.mark_running(job['id'])
+            JOB_REPORT_DIR.mkdir(parents=True, exist_ok=True)
+            report_path = JOB_REPORT_DIR / f"job_{job['id']}.json"
+            log_file = open(JOB_REPORT_DIR / f"job_{job['id']}.log", 'a', encoding='utf-8')
+
+            cores = []
+            if free_cores is not None:
+                cores, free_cores = free_cores[:JOB_CPUS], free_cores[JOB_CPUS:]
+            job_cpus = len(cores) or min(JOB_CPUS, total_cpus)
+
+            process = subprocess.Popen(
+                job_command(job, report_path),
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                cwd=str(Path(__file__).parent),
+                env={**os.environ, JOB_CPUS_ENV: str(job_cpus), 'OMP_NUM_THREADS': str(job_cpus)},     # OCR pool, render pool and math libraries size to the share
+                preexec_fn=(lambda: os.sched_setaffinity(0, cores)) if cores else None      # Everything the job starts inherits the pinning
+            )
+            running[job['id']] = (process, report_path, log_file, cores)
+            print(f"[{datetime.now():%H:%M:%S}] Job {job['id']} started ({format_bytes(job['size_bytes'])}, attempt {job['attempts'] + 1} of {job['max_attempts']}): {job['input_dir']}")
+
+        if once and not running and not queue.next_queued():
+            return
+        time.sleep(JOB_POLL_SECONDS)
+
+def print_status(queue, show_all=False):
+    """
+    Queue listing: running and queued jobs (plus finished ones with show_all)
+    """
+    jobs = queue.jobs() if show_all else queue.jobs(('running', 'queued', 'failed'))
+    counts = {}
+    for job in queue.jobs():
+        counts[job['status']] = counts.get(job['status'], 0) + 1
+    print(f"Jobs: {' | '.join(f'{status}: {count}' for status, count in sorted(counts.items())) or 'none'}")
+    if not jobs:
+        return
+
+    print("")
+    print(f"{'id':>5} | {'status':>7} | {'tries':>5} | {'size':>10} | {'time':>12} | input")
+    print("-" * 75)
+    for job in jobs:
+        if job['started'] and job['finished']:
+            elapsed = display_time(int(job['finished'] - job['started'])) or "0 seconds"
+        elif job['started'] and job['status'] == 'running':
+            elapsed = display_time(int(time.time() - job['started'])) or "0 seconds"
+        else:
+            elapsed = "-"
+        print(f"{job['id']:>5} | {job['status']:>7} | {job['attempts']:>2}/{job['max_attempts']:<2} | {format_bytes(job['size_bytes']):>10} | {elapsed:>12} | {job['input_dir']}")
+        if job['error']:
+            print(f"{bcolors.FAIL}{'':>8}{job['error']}{bcolors.ENDC}")
+
+# -------------------------------- END --------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue and run sort jobs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Queue a sort job")
+    submit.add_argument("input_dir", help="Directory holding the drawing set PDFs")
+    reference = submit.add_mutually_exclusive_group(required=True)
+    reference.add_argument("--airtable", metavar="URL", help="Airtable view URL with the reference order")
+    reference.add_argument("--csv", metavar="PATH", help="Reference CSV with the order")
+    submit.add_argument("--output", metavar="DIR", help="Where SORTED_combined.pdf goes (default: the input directory)")
+    submit.add_argument("--max-attempts", type=int, default=JOB_MAX_ATTEMPTS, help="Runs before a failing job is given up on")
+
+    run = commands.add_parser("run", help="Run the scheduler")
+    run.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+
+    status = commands.add_parser("status", help="Show the queue")
+    status.add_argument("--all", action="store_true", help="Include finished jobs")
+
+    retry = commands.add_parser("retry", help="Queue a failed job again")
+    retry.add_argument("job_id", type=int)
+
+    args = parser.parse_args()
+    queue = JobQueue()
+
+    try:
+        if args.command == "submit":
+            if not Path(args.input_dir).is_dir():
+                parser.error(f"input directory not found: {args.input_dir}")
+            if args.csv and not Path(args.csv).is_file():
+                parser.error(f"reference CSV not found: {args.csv}")
+            job_id = queue.submit(args.input_dir, args.airtable, args.csv, args.output, args.max_attempts)
+            print(f"{bcolors.OKGREEN}Queued job {job_id}{bcolors.ENDC}")
+        elif args.command == "run":
+            if not run_scheduler(queue, once=args.once):
+                sys.exit(1)
+        elif args.command == "status":
+            print_status(queue, show_all=args.all)
+        elif args.command == "retry":
+            if queue.retry(args.job_id):
+                print(f"{bcolors.OKGREEN}Job {args.job_id} queued again{bcolors.ENDC}")
+            else:
+                print(f"{bcolors.FAIL}No failed job {args.job_id}{bcolors.ENDC}")
+                sys.exit(1)
+    except KeyboardInterrupt:
+        print(f"{bcolors.WARNING}Scheduler stopped, running jobs are put back in the queue on the next start{bcolors.ENDC}")
+    finally:
+        queue.close()
+
+if __name__ == "__main__":
+    main()
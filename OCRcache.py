@@ -0,0 +1,174 @@
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+from importlib import metadata
+from DEdependencies import load_settings
+
+"""
+Persistent OCR result cache.
+The same drawing sets get re-sorted over and over as the Airtable order changes, and every run used to OCR every page again.
+Results are stored in SQLite keyed by a hash of what actually ends up in the title block crop:
+the page's content streams, every object its resources point at (fonts, images, form XObjects), the crop rect, the render DPI and the OCR engine version.
+A hit skips rendering and OCR for that page completely. Entries carry a size and a last-used time, and the least recently used ones
+are evicted whenever the cache grows past ocr_cache_max_mb, so it can live on a shared build box.
+Several sort jobs share it at once, so every write is committed right away (a transaction left open through a file's OCR would lock
+every other job out), and a cache that is still busy after OCR_CACHE_BUSY_SECONDS counts as a miss instead of failing the file.
+"""
+
+settings = load_settings()
+
+OCR_CACHE_PATH = Path(__file__).parent / settings.get('ocr_cache_path', '_ocrcache_/ocr_cache.sqlite3')
+OCR_CACHE_MAX_BYTES = settings.getint('ocr_cache_max_mb', 512) * 1024 * 1024
+OCR_CACHE_BUSY_SECONDS = 5      # How long a read / write waits on another job's write before giving up
+
+# ------------------------- Custom Functions --------------------------
+
+def ocr_engine_version():
+    """
+    Version tag of the OCR engine, cached results from another PaddleOCR version are never reused
+    """
+    try:
+        return f"paddleocr-{metadata.version('paddleocr')}"
+    except metadata.PackageNotFoundError:
+        return "paddleocr-unknown"
+
+class OCRCache:
+    """
+    SQLite-backed, size-bounded LRU cache of title block OCR results
+    """
+    def __init__(self, path=OCR_CACHE_PATH, max_bytes=OCR_CACHE_MAX_BYTES):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.max_bytes = max_bytes
+        self.engine_version = ocr_engine_version()
+        self.xref_digests = {}      # xref -> digest of digest_doc, fonts/images shared by every page are only hashed once per document
+        self.digest_doc = None      # Held on purpose, a closed document's id() is reused by the next one and its xrefs mean something else there
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(str(path), timeout=OCR_CACHE_BUSY_SECONDS)
+        self.conn.execute("PRAGMA journal_mode=WAL")        # Several jobs can read while one writes
+        self.conn.execute("PRAGMA synchronous=NORMAL")      # No fsync per commit, a crash can only lose the last few results
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                key TEXT PRIMARY KEY,
+                rec_texts TEXT NOT NULL,
+                rec_scores TEXT NOT NULL,
+                drawing_number TEXT,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ocr_cache_last_used ON ocr_cache (last_used)")
+        self.conn.commit()
+
+    def xref_digest(self, doc, xref):
+        """
+        Hash of one PDF object and its stream (cached per document)
+        """
+        if doc is not self.digest_doc:
+            self.xref_digests = {}
+            self.digest_doc = doc
+        digest = self.xref_digests.get(xref)
+        if digest is None:
+            sha = hashlib.sha256(doc.xref_object(xref, compressed=True).encode('utf-8', 'replace'))
+            if doc.xref_is_stream(xref):
+                sha.update(doc.xref_stream_raw(xref) or b'')
+            digest = sha.digest()
+            self.xref_digests[xref] = digest
+        return digest
+
+    def page_key(self, page, clip, dpi):
+        """
+        Content address of a page's title block crop
+
+        Args:
+            page (fitz.Page): PyMuPDF page object
+            clip (fitz.Rect): Area of the page that gets rendered
+            dpi (int | str): Render DPI, or the whole DPI ladder when the result depends on escalation
+        """
+        doc = page.parent
+        sha = hashlib.sha256()
+        sha.update(page.read_contents())
+        sha.update(doc.xref_object(page.xref, compressed=True).encode('utf-8', 'replace'))     # Resources dict, boxes, rotation
+
+        resource_xrefs = set()
+        resource_xrefs.update(image[0] for image in page.get_images(full=True))
+        resource_xrefs.update(font[0] for font in page.get_fonts(full=True))
+        resource_xrefs.update(xobject[0] for xobject in page.get_xobjects())
+        for xref in sorted(resource_xrefs):
+            if xref > 0:
+                sha.update(self.xref_digest(doc, xref))
+
+        sha.update(f"|{clip.x0:.2f},{clip.y0:.2f},{clip.x1:.2f},{clip.y1:.2f}|{dpi}|{self.engine_version}".encode())
+        return sha.hexdigest()
+
+    def get(self, key):
+        """
+        Cached {'rec_texts', 'rec_scores', 'drawing_number'} of a page, or None (also when the cache is busy)
+        """
+        try:
+            row = self.conn.execute(
+                "SELECT rec_texts, rec_scores, drawing_number FROM ocr_cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            self.conn.execute("UPDATE ocr_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            self.conn.rollback()        # LRU order is only a hint, the hit still counts
+        return {
+            'rec_texts': json.loads(row[0]),
+            'rec_scores': json.loads(row[1]),
+            'drawing_number': row[2]
+        }
+
+    def put(self, key, ocr_data, drawing_number):
+        """
+        Stores the OCR output of a page, dropped if the cache stays busy (the page is just OCR'd again next time)
+        """
+        rec_texts = json.dumps(ocr_data.get('rec_texts', []))
+        rec_scores = json.dumps(ocr_data.get('rec_scores', []))
+        size = len(key) + len(rec_texts) + len(rec_scores) + len(drawing_number or '')
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, rec_texts, rec_scores, drawing_number, size, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, rec_texts, rec_scores, drawing_number, size, time.time())
+            )
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            self.conn.rollback()
+
+    def evict(self):
+        """
+        Drops the least recently used entries until the cache fits in max_bytes, returns how many were dropped
+        (0 if the cache is busy, the next job to close it evicts instead)
+        """
+        try:
+            evicted = self.conn.execute("""
+                DELETE FROM ocr_cache WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS running_size FROM ocr_cache
+                    ) WHERE running_size > ?
+                )
+            """, (self.max_bytes,)).rowcount
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            self.conn.rollback()
+            return 0
+        return evicted
+
+    def close(self):
+        self.evict()
+        self.conn.close()
+
+# -------------------------------- END --------------------------------
@@ -0,0 +1,600 @@
+import os
+import sys
+import time
+import socket
+import secrets
+import threading
+import subprocess
+import multiprocessing
+import numpy as np
+from pathlib import Path
+from contextlib import nullcontext
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from DEdependencies import bcolors
+from DEdependencies import load_settings
+from DEdependencies import available_cores
+from DEdependencies import job_cpu_limit
+from DEdependencies import job_root
+from DEdependencies import emit_event
+
+"""
+Everything the OCR stages need to talk to PaddleOCR.
+Loading the PaddleOCR models dominates small jobs, and every stage used to build its own PaddleOCR(...) at import time.
+Running this file starts a long-lived OCR worker that loads the model ONCE and then serves page images over a local socket
+(multiprocessing.connection, authenticated with a per-session key). ApplicationManager starts it once per session and every
+OCR stage it launches submits to it. When no worker is running (stage run by hand) get_ocr_engine() loads PaddleOCR in-process like before.
+
+Both engines have the same predict(images) -> [{'rec_texts': [...], 'rec_scores': [...]}, ...] interface, one dict per image.
+
+On machines without a GPU (ocr_device = cpu, or auto with no CUDA device) a single PaddleOCR instance leaves most cores idle,
+so OCRPool runs several instances in a process pool sized to the core count. Each instance gets its own slice of cores
+(intra-op threads capped through cpu_threads / OMP_NUM_THREADS and, where the OS allows it, CPU affinity) so they don't oversubscribe.
+Under JobQueue.py the pool is sized to the job's share of cores (PDFSORTER_JOB_CPUS), not the whole machine.
+"""
+
+settings = load_settings()
+
+OCR_WORKER_HOST = '127.0.0.1'
+OCR_WORKER_PORT = int(os.environ.get('PDFSORTER_OCR_PORT', settings.getint('ocr_worker_port', 50515)))
+OCR_WORKER_KEY_ENV = 'PDFSORTER_OCR_AUTHKEY'     # Stages only connect when the manager handed them the session key
+OCR_BATCH_SIZE = max(1, settings.getint('ocr_batch_size', 8))
+OCR_DEVICE = settings.get('ocr_device', 'auto').strip().lower()            # gpu | cpu | auto
+OCR_CPU_INSTANCES = settings.getint('ocr_cpu_instances', 0)                # 0 = pick from the core count
+OCR_CPU_THREADS = settings.getint('ocr_cpu_threads', 0)                    # 0 = pick from the core count
+
+# ------------------------- Custom Functions --------------------------
+
+def create_ocr_engine(device='gpu', batch_size=None, cpu_threads=None):
+    """
+    Builds the PaddleOCR engine (slow, loads all the models)
+
+    Args:
+        device (str): 'gpu' (fp16) or 'cpu'
+        batch_size (int): Text recognition batch size, defaults to ocr_batch_size in config.ini
+        cpu_threads (int): Intra-op threads of a CPU engine (None lets Paddle decide)
+    """
+    from paddleocr import PaddleOCR
+
+    if batch_size is None:
+        batch_size = OCR_BATCH_SIZE
+
+    print(f"{bcolors.OKCYAN}Initializing PaddleOCR...{bcolors.ENDC}")
+    if device == 'gpu':
+        return PaddleOCR(
+            lang='en',
+            use_textline_orientation=False,
+            text_recognition_batch_size=batch_size,
+            device='gpu',
+            precision='fp16'                # half‑precision for speed
+        )
+    if cpu_threads:
+        return PaddleOCR(
+            lang='en',
+            use_textline_orientation=False,
+            text_recognition_batch_size=batch_size,
+            device=device,
+            cpu_threads=cpu_threads,
+            enable_mkldnn=True
+        )
+    return PaddleOCR(
+        lang='en',
+        use_textline_orientation=False,
+        text_recognition_batch_size=batch_size,
+        device=device
+    )
+
+def resolve_device(device=OCR_DEVICE):
+    """
+    Turns ocr_device = auto into gpu or cpu depending on whether Paddle can see a CUDA device
+    """
+    if device != 'auto':
+        return device
+    try:
+        import paddle
+        if paddle.device.is_compiled_with_cuda() and paddle.device.cuda.device_count() > 0:
+            return 'gpu'
+    except Exception:
+        pass
+    return 'cpu'
+
+def plan_cpu_pool(cores, instances=0, threads=0, cap=False):
+    """
+    Picks (instances, threads per instance) so instances * threads never exceeds the core count.
+    PaddleOCR stops scaling past ~4 intra-op threads on small title block crops, so by default cores go to more instances instead.
+
+    Args:
+        cores (int): Cores available to the pool
+        instances (int): Fixed number of PaddleOCR instances (0 = auto)
+        threads (int): Fixed intra-op threads per instance (0 = auto)
+        cap (bool): Keep fixed instances / threads inside cores too (a job's share of a shared machine)
+    """
+    cores = max(1, cores)
+    if instances > 0 and threads > 0:
+        pass
+    elif instances > 0:
+        threads = max(1, cores // instances)
+    else:
+        if threads <= 0:
+            threads = min(4, max(1, cores // 4))
+        instances = max(1, cores // threads)
+
+    if cap:
+        instances = min(instances, cores)
+        threads = max(1, min(threads, cores // instances))
+    return instances, threads
+
+def pin_threads(threads, core_ids=None):
+    """
+    Caps the intra-op thread pools of this process (must run before paddle is imported) and pins it to core_ids if given
+    """
+    for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'FLAGS_paddle_num_threads'):
+        os.environ[variable] = str(threads)
+    if core_ids and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, core_ids)
+        except OSError:
+            pass
+
+def engine_images(images):
+    """
+    PaddleOCR wants HxWx3 crops. Grayscale crops (render_profile = gray) travel single-channel through the queue, socket and pool
+    and only get their three channels back here, right before predict()
+    """
+    return [np.repeat(image[..., None], 3, axis=2) if image.ndim == 2 else image for image in images]
+
+def ocr_results(raw_results):
+    """
+    Converts PaddleOCR result objects into plain dicts (picklable, so they can go over the worker socket)
+    """
+    results = []
+    for ocr_data in raw_results or []:
+        results.append({
+            'rec_texts': list(ocr_data.get('rec_texts', [])),
+            'rec_scores': [float(score) for score in ocr_data.get('rec_scores', [])]
+        })
+    return results
+
+class LocalOCR:
+    """
+    PaddleOCR loaded inside the current process (fallback when no OCR worker is running)
+    """
+    thread_safe = False
+
+    def __init__(self, device='gpu', cpu_threads=None):
+        self.engine = create_ocr_engine(device, cpu_threads=cpu_threads)
+        self.batch_capacity = OCR_BATCH_SIZE
+        self.description = f"1 PaddleOCR instance on {device}"
+
+    def predict(self, images):
+        return ocr_results(self.engine.predict(engine_images(images)))
+
+    def close(self):
+        pass
+
+pool_engine = None      # The PaddleOCR instance of an OCRPool worker process
+pool_engine_error = None        # Why loading it failed, reported back by pool_worker_check() instead of killing the process
+
+def pool_worker_init(threads, slot_counter, core_ids, batch_size):
+    """
+    Runs once in every OCRPool process: pins its threads to its own slice of cores, then loads PaddleOCR
+    """
+    global pool_engine, pool_engine_error
+
+    with slot_counter.get_lock():
+        slot = slot_counter.value
+        slot_counter.value += 1
+
+    # An exception escaping an initializer makes Pool restart the process forever and map() never returns, keep it for pool_worker_check()
+    try:
+        pin_threads(threads, core_ids[slot * threads:(slot + 1) * threads])
+        pool_engine = create_ocr_engine('cpu', batch_size=batch_size, cpu_threads=threads)
+    except Exception as e:
+        pool_engine_error = f"{type(e).__name__}: {e}"
+
+def pool_worker_check(_):
+    """
+    Startup check run once per pool process, None when its PaddleOCR instance loaded
+    """
+    if pool_engine is None:
+        return pool_engine_error or "PaddleOCR was not loaded"
+    return None
+
+def pool_worker_predict(images):
+    if pool_engine is None:
+        raise RuntimeError(f"OCR pool process has no engine: {pool_engine_error}")
+    return ocr_results(pool_engine.predict(engine_images(images)))
+
+class OCRPool:
+    """
+    Several CPU PaddleOCR instances in a process pool, same predict() as LocalOCR.
+    A predict() call is split into one chunk per instance so every instance works on its part of the batch at the same time.
+    """
+    thread_safe = True
+    startup_timeout = 300       # Seconds for every instance to load its model
+    predict_timeout = 600       # Seconds for one predict() call, a hung instance fails the batch instead of the whole run
+
+    def __init__(self, instances=OCR_CPU_INSTANCES, threads=OCR_CPU_THREADS, batch_size=OCR_BATCH_SIZE):
+        cores = available_cores()
+        self.instances, self.threads = plan_cpu_pool(cores, instances, threads, cap=job_cpu_limit() is not None)
+        self.batch_capacity = batch_size * self.instances
+        self.description = f"{self.instances} PaddleOCR instance(s) x {self.threads} thread(s) on {cores} CPU core(s)"
+
+        if hasattr(os, 'sched_getaffinity'):
+            core_ids = sorted(os.sched_getaffinity(0))
+        else:
+            core_ids = []
+        if self.instances * self.threads > len(core_ids) or len(core_ids) > cores:
+            core_ids = []       # More threads than cores asked for on purpose, or a job share that isn't pinned to its own cores, don't pin
+
+        context = multiprocessing.get_context('spawn')      # Never fork a process that may have Paddle's thread pools running
+        print(f"{bcolors.OKCYAN}Starting OCR pool: {self.description}{bcolors.ENDC}")
+        self.pool = context.Pool(
+            processes=self.instances,
+            initializer=pool_worker_init,
+            initargs=(self.threads, context.Value('i', 0), core_ids, batch_size)
+        )
+
+        # One check per process (chunksize=1) so every instance has loaded its model, or reported why it couldn't, before the first batch
+        try:
+            errors = self.pool.map_async(pool_worker_check, range(self.instances), chunksize=1).get(timeout=self.startup_timeout)
+        except multiprocessing.TimeoutError:
+            errors = [f"instances did not load within {self.startup_timeout} seconds"]
+        errors = [error for error in errors if error]
+        if errors:
+            self.pool.terminate()
+            raise RuntimeError(f"OCR pool failed to start: {errors[0]}")
+
+    def predict(self, images):
+        images = list(images)
+        chunk = max(1, -(-len(images) // self.instances))      # Ceiling division, one chunk per instance
+        chunks = [images[i:i + chunk] for i in range(0, len(images), chunk)]
+        results = []
+        try:
+            pool_results = self.pool.map_async(pool_worker_predict, chunks).get(timeout=self.predict_timeout)
+        except multiprocessing.TimeoutError:
+            raise RuntimeError(f"OCR pool did not answer within {self.predict_timeout} seconds")
+        for chunk_results in pool_results:
+            results.extend(chunk_results)
+        return results
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+def open_local_engine(device=OCR_DEVICE):
+    """
+    Loads the OCR engine for this machine: one GPU instance, or a pool of pinned CPU instances.
+    Only call this from a module with a __main__ guard (the OCR worker, benchmarks), see get_ocr_engine()
+    """
+    device = resolve_device(device)
+    if device == 'cpu':
+        instances, threads = plan_cpu_pool(available_cores(), OCR_CPU_INSTANCES, OCR_CPU_THREADS, cap=job_cpu_limit() is not None)
+        if instances > 1:
+            return OCRPool(instances, threads)
+        return LocalOCR('cpu', cpu_threads=threads)
+    return LocalOCR(device)
+
+class OCRClient:
+    """
+    Connection to a running OCR worker, same predict() as LocalOCR
+    """
+    thread_safe = False
+
+    def __init__(self, authkey, port=OCR_WORKER_PORT):
+        self.conn = Client((OCR_WORKER_HOST, port), authkey=authkey)
+        self.batch_capacity, self.description = self.request('describe')
+        self.owned_process = None       # Set when this client started the worker itself and has to stop it
+
+    def request(self, *message):
+        self.conn.send(message)
+        status, payload = self.conn.recv()
+        if status != 'ok':
+            raise RuntimeError(f"OCR worker error: {payload}")
+        return payload
+
+    def predict(self, images):
+        return self.request('predict', images)
+
+    def close(self):
+        if self.owned_process is not None:
+            try:
+                self.request('shutdown')
+            except (OSError, EOFError, RuntimeError):
+                pass
+            self.owned_process.wait(timeout=30)
+            self.owned_process = None
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+
+class LazyOCR:
+    """
+    Only connects to / loads the OCR engine the first time a page actually needs OCR,
+    so a drawing set whose text layer answers every page never pays for PaddleOCR at all
+    """
+    def __init__(self):
+        self.engine = None
+
+    def load(self):
+        if self.engine is None:
+            self.engine = get_ocr_engine()
+        return self.engine
+
+    @property
+    def batch_capacity(self):
+        return self.load().batch_capacity
+
+    @property
+    def description(self):
+        if self.engine is None:
+            return "OCR engine not needed"
+        return self.engine.description
+
+    def predict(self, images):
+        return self.load().predict(images)
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.close()
+
+class OCRBatcher:
+    """
+    Collects rendered title block crops and sends them through the engine N at a time instead of one predict() per page.
+    Every image is added with a key (pdf_name, page_number) and comes back out with that key, in the order it went in.
+    Keys of pages whose batch failed are kept in failed_pages (an error event is emitted for each failed batch).
+    """
+    def __init__(self, engine, batch_size=None):
+        self.engine = engine
+        self.batch_size = batch_size        # None = ask the engine on the first add() (an OCRPool takes one batch per instance)
+        self.keys = []
+        self.images = []
+        self.failed_pages = []
+
+    @property
+    def failed(self):
+        return bool(self.failed_pages)
+
+    def add(self, key, image):
+        """
+        Queues one image, returns the finished [(key, ocr_data), ...] whenever a full batch went through (else [])
+        """
+        if self.batch_size is None:
+            self.batch_size = max(1, getattr(self.engine, 'batch_capacity', OCR_BATCH_SIZE))
+        self.keys.append(key)
+        self.images.append(image)
+        if len(self.images) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Runs whatever is queued, ocr_data is None for every page of a batch that failed
+        """
+        if not self.images:
+            return []
+
+        keys, images = self.keys, self.images
+        self.keys, self.images = [], []
+
+        try:
+            results = self.engine.predict(images)
+        except Exception as ocr_error:
+            return self.fail(keys, str(ocr_error))
+
+        if len(results) != len(keys):
+            return self.fail(keys, f"got {len(results)} results for {len(keys)} pages")
+
+        return list(zip(keys, results))
+
+    def fail(self, keys, reason):
+        """
+        Reports a failed batch and hands its pages back without OCR data
+        """
+        message = f"OCR error on pages {keys[0][1]}-{keys[-1][1]} of {keys[0][0]}: {reason}"
+        print(f"{bcolors.FAIL}  {message}{bcolors.ENDC}")
+        emit_event('error', message=message, pdf_name=keys[0][0], pages=[key[1] for key in keys])
+        self.failed_pages.extend(keys)
+        return [(key, None) for key in keys]
+
+def connect_ocr_worker(port=OCR_WORKER_PORT):
+    """
+    Returns an OCRClient if a worker for this session is listening, otherwise None
+    """
+    authkey = os.environ.get(OCR_WORKER_KEY_ENV)
+    if not authkey:
+        return None
+    try:
+        return OCRClient(authkey.encode(), port)
+    except (OSError, EOFError, RuntimeError, AuthenticationError):
+        return None
+
+def get_ocr_engine():
+    """
+    OCR engine for a stage: the session's OCR worker if there is one, otherwise PaddleOCR loaded in-process.
+    A CPU pool is only ever started inside an OCR worker (the stage scripts have no __main__ guard, so spawned pool
+    processes can't re-import them), so a stage that needs one starts its own worker and stops it again on close().
+    """
+    client = connect_ocr_worker()
+    if client is not None:
+        print(f"{bcolors.OKCYAN}Using running OCR worker on port {OCR_WORKER_PORT} ({client.description}){bcolors.ENDC}")
+        return client
+
+    device = resolve_device()
+    if device == 'cpu':
+        instances, threads = plan_cpu_pool(available_cores(), OCR_CPU_INSTANCES, OCR_CPU_THREADS, cap=job_cpu_limit() is not None)
+        if instances == 1:
+            return LocalOCR('cpu', cpu_threads=threads)
+
+        port = free_port()
+        try:
+            process = ensure_ocr_worker(port=port)
+        except RuntimeError as e:
+            print(f"{bcolors.WARNING}{e}, falling back to a single in-process PaddleOCR instance{bcolors.ENDC}")
+            return LocalOCR('cpu', cpu_threads=available_cores())
+
+        client = connect_ocr_worker(port)
+        if client is None:
+            process.terminate()
+            process.wait(timeout=30)
+            print(f"{bcolors.WARNING}Could not connect to the OCR worker on port {port}, falling back to a single in-process PaddleOCR instance{bcolors.ENDC}")
+            return LocalOCR('cpu', cpu_threads=available_cores())
+        client.owned_process = process
+        print(f"{bcolors.OKCYAN}Started OCR worker for this run ({client.description}){bcolors.ENDC}")
+        return client
+
+    return LocalOCR(device)
+
+def free_port():
+    """
+    Asks the OS for a local port nobody is listening on
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((OCR_WORKER_HOST, 0))
+        return sock.getsockname()[1]
+
+def ocr_worker_log(port):
+    """
+    Startup log of the OCR worker on this port, in the job's _workingdata_
+    """
+    return job_root() / "_workingdata_" / f"ocr_worker_{port}.log"
+
+def ensure_ocr_worker(timeout=300, port=None):
+    """
+    Starts the OCR worker for this session if it isn't running yet and waits until the model is loaded.
+    The session key goes into os.environ so every stage subprocess started afterwards inherits it.
+    The worker's output until it is listening goes to ocr_worker_log(port), so a failed start can be diagnosed.
+
+    Args:
+        timeout (int): Seconds to wait for the model to load
+        port (int): Port for the worker, defaults to the session port (ocr_worker_port in config.ini)
+
+    Returns:
+        subprocess.Popen | None: The worker process if this call started it, None if one was already running
+    """
+    os.environ.setdefault(OCR_WORKER_KEY_ENV, secrets.token_hex(16))
+    if port is None:
+        port = int(os.environ.setdefault('PDFSORTER_OCR_PORT', str(OCR_WORKER_PORT)))
+
+    client = connect_ocr_worker(port)
+    if client is not None:
+        client.close()
+        return None
+
+    log_path = ocr_worker_log(port)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, 'w') as log_file:       # The worker keeps its own handle until it is listening, see serve()
+        process = subprocess.Popen(
+            [sys.executable, str(Path(__file__))],
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            cwd=str(Path(__file__).parent),
+            env={**os.environ, 'PDFSORTER_OCR_PORT': str(port)}
+        )
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"OCR worker exited during startup with code {process.returncode}, see {log_path}")
+        client = connect_ocr_worker(port)
+        if client is not None:
+            client.close()
+            return process
+        time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError(f"OCR worker did not start within {timeout} seconds, see {log_path}")
+
+def stop_ocr_worker(port=OCR_WORKER_PORT):
+    """
+    Asks the session's OCR worker to shut down (no-op if there isn't one)
+
+    Args:
+        port (int): Port the worker listens on, defaults to the session port
+    """
+    client = connect_ocr_worker(port)
+    if client is not None:
+        try:
+            client.request('shutdown')
+        except (OSError, EOFError, RuntimeError):
+            pass
+        client.close()
+
+def serve_connection(conn, engine, engine_lock, stop_event):
+    """
+    Handles one stage's connection until it hangs up
+    """
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+
+            command = message[0]
+            try:
+                if command == 'ping':
+                    conn.send(('ok', 'pong'))
+                elif command == 'describe':
+                    conn.send(('ok', (engine.batch_capacity, engine.description)))
+                elif command == 'predict':
+                    with engine_lock:       # A single PaddleOCR instance isn't thread safe, stages take turns
+                        conn.send(('ok', engine.predict(message[1])))
+                elif command == 'shutdown':
+                    stop_event.set()
+                    conn.send(('ok', 'bye'))
+                    Client((OCR_WORKER_HOST, OCR_WORKER_PORT), authkey=os.environ[OCR_WORKER_KEY_ENV].encode()).close()     # Wake up accept() so serve() can exit
+                    break
+                else:
+                    conn.send(('error', f"Unknown command: {command}"))
+            except Exception as e:
+                conn.send(('error', str(e)))
+    finally:
+        conn.close()
+
+def release_startup_log():
+    """
+    Points stdout/stderr at the null device once the worker is up, so it doesn't hold the startup log
+    in the job's _workingdata_ open for the rest of the session (the sorter deletes that folder)
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.dup2(devnull, sys.stderr.fileno())
+    os.close(devnull)
+
+def serve(port=OCR_WORKER_PORT):
+    """
+    Loads the OCR model once, then serves predict requests until asked to shut down
+    """
+    authkey = os.environ.get(OCR_WORKER_KEY_ENV)
+    if not authkey:
+        raise RuntimeError(f"{OCR_WORKER_KEY_ENV} is not set, start the worker through ensure_ocr_worker()")
+
+    engine = open_local_engine()
+    engine_lock = nullcontext() if engine.thread_safe else threading.Lock()
+    stop_event = threading.Event()
+
+    listener = Listener((OCR_WORKER_HOST, port), authkey=authkey.encode())
+    print(f"{bcolors.OKGREEN}OCR worker listening on {OCR_WORKER_HOST}:{port}{bcolors.ENDC}")
+    release_startup_log()
+
+    while not stop_event.is_set():
+        try:
+            conn = listener.accept()
+        except Exception:
+            continue    # Failed handshake (wrong key), keep serving
+        if stop_event.is_set():
+            conn.close()
+            break
+        threading.Thread(target=serve_connection, args=(conn, engine, engine_lock, stop_event), daemon=True).start()
+
+    listener.close()
+    engine.close()
+
+# -------------------------------- END --------------------------------
+
+if __name__ == "__main__":
+    serve()
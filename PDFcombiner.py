@@ -1,4 +1,3 @@
-import os
 import sys
 sys.stdout.reconfigure(encoding='utf-8')
 import fitz
@@ -7,14 +6,25 @@ from pathlib import Path
 from DEdependencies import bcolors
 from DEdependencies import display_time
 from DEdependencies import printProgressBar
+from DEdependencies import job_root
+from DEdependencies import write_page_manifest
+from DEdependencies import PAGE_MANIFEST_PATH
+from DEdependencies import emit_event
 
-dirpath = Path(__file__).parent.as_posix()
+"""
+Used to merge every input PDF into one combined.pdf (and delete the inputs) so the rest of the pipeline had a single document to work on.
+That is a full read + write of the whole drawing set, with all of it in memory at once, just to renumber pages.
+Now this only writes a page manifest (_workingdata_/page_manifest.json): every input file with its page count and the global page number it starts at.
+TitleBlockOCR.py reads pages through it and the sorters copy pages straight out of the original files, so the inputs are left untouched.
+"""
+
+dirpath = job_root().as_posix()      # Job-scoped working root (PDFSORTER_JOB_ROOT), the script directory by default
 
 input_directory = Path(f"{dirpath}/PDFsToProcess")   # For iterating over all the files
 
 input_directory.mkdir(parents=True, exist_ok=True)   # Create output directory if it doesn't exist
 
-file_paths = [f for f in input_directory.iterdir() if f.suffix.lower() == '.pdf']   # Get all PDF files in the directory
+file_paths = sorted(f for f in input_directory.iterdir() if f.suffix.lower() == '.pdf')   # Get all PDF files in the directory (sorted so page numbers are the same every run)
 
 successcount = 0
 totalcount = 0
@@ -22,8 +32,7 @@ total_pages = 0
 
 total_time_start = time.time()
 
-# Create a new empty PDF for the combined result
-combined_doc = fitz.open()
+manifest = []       # Virtual combined document, one entry per input file
 
 print(f"{bcolors.HEADER}Starting PDF combination process...{bcolors.ENDC}")
 print(f"Found {len(file_paths)} PDF files to combine")
@@ -34,39 +43,39 @@ loadcount = 0
 
 for file_path in file_paths:
     loadcount += 1
-    start_time = time.time()     # START TIME OF FILE PROCESSING
     try:
-        # dashes = "-" * 25
-        # print(f"{dashes}{bcolors.UNDERLINE}Processing: {file_path.stem}.pdf{bcolors.ENDC}{dashes}")
-
-        doc = fitz.open(str(file_path))     # Open the current PDF
+        doc = fitz.open(str(file_path))     # Open the current PDF (only to count its pages)
         
         if doc.page_count == 0:
             print(f"{bcolors.WARNING}Warning: {file_path.name} has no pages, skipping...{bcolors.ENDC}")
+            emit_event('warning', message=f"{file_path.name} has no pages, skipping")
             doc.close()
             totalcount += 1
             continue
 
-        combined_doc.insert_pdf(doc)        # Insert all pages from the current PDF into the combined PDF
+        manifest.append({
+            'path': str(file_path.resolve()),
+            'name': file_path.stem,
+            'page_count': doc.page_count,
+            'first_page': total_pages + 1       # Global page number of this file's first page
+        })
         
         pages_added = doc.page_count
         total_pages += pages_added
         
         # Close the current document
         doc.close()
-
-        end_time = time.time()
-        file_time = end_time - start_time
         
         successcount += 1
         totalcount += 1
 
-        printProgressBar(loadcount, total_pdfs)
+        printProgressBar(loadcount - 1, total_pdfs)
 
     except Exception as e:
         print("")
         print("-" * 75)
         print(f"{bcolors.FAIL}Error processing {file_path.name}: {str(e)}{bcolors.ENDC}")
+        emit_event('error', message=f"Error processing {file_path.name}: {str(e)}")
         print("-" * 75)
         print("")
         if 'doc' in locals():
@@ -75,35 +84,23 @@ for file_path in file_paths:
         totalcount += 1
         continue
 
-# Save the combined PDF if we successfully processed any files
+# Save the page manifest if we successfully processed any files
 if successcount > 0:
     try:
-        # Generate output filename with timestamp to avoid overwriting
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"combined.pdf"
-        
         print("")
-        print(f"{bcolors.OKBLUE}Saving combined PDF...{bcolors.ENDC}")
+        print(f"{bcolors.OKBLUE}Saving page manifest...{bcolors.ENDC}")
         
-        # Save the combined PDF
-        combined_doc.save(str(f"{input_directory}/{output_filename}"))
-        combined_doc.close()
+        write_page_manifest(manifest)
         
-        print(f"{bcolors.OKGREEN}Combined PDF saved as: {output_filename}{bcolors.ENDC}")
-        print(f"Total pages in combined PDF: {total_pages}")
+        print(f"{bcolors.OKGREEN}Page manifest saved as: {PAGE_MANIFEST_PATH.name}{bcolors.ENDC}")
+        print(f"Total pages in combined set: {total_pages}")
         
     except Exception as e:
-        print(f"{bcolors.FAIL}Error saving combined PDF: {str(e)}{bcolors.ENDC}")
-        combined_doc.close()
+        print(f"{bcolors.FAIL}Error saving page manifest: {str(e)}{bcolors.ENDC}")
+        emit_event('error', message=f"Error saving page manifest: {str(e)}")
 else:
     print(f"{bcolors.WARNING}No PDFs were successfully processed. No output file created.{bcolors.ENDC}")
-    combined_doc.close()
-
-# Cleanup old broken files
-for file_path in file_paths:
-    if file_path.name != "combined.pdf":
-        os.remove(file_path)
+    emit_event('error', message="No PDFs were successfully processed, no page manifest created")
 
 total_time_end = time.time()
 elapsed_total_time = total_time_end - total_time_start
@@ -114,4 +111,6 @@ print(f"{bcolors.OKGREEN}PDF COMBINATION COMPLETE{bcolors.ENDC}")
 print(f"Successfully combined {successcount} PDF(s) out of {totalcount} PDF(s)")
 print(f"Total pages combined: {total_pages}")
 print(f"Total time: {elapsed_total_time:.2f} seconds [{display_time(elapsed_total_time)}]")
-print("=" * 75)
\ No newline at end of file
+print("=" * 75)
+
+emit_event('summary', files=successcount, total_files=totalcount, pages=total_pages, seconds=round(elapsed_total_time, 2))
\ No newline at end of file
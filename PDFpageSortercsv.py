@@ -5,14 +5,19 @@ import shutil
 import time
 import csv
 import re
-import pymupdf
 from pathlib import Path
 from DEdependencies import bcolors
 from DEdependencies import printProgressBar
+from DEdependencies import job_root
 from DEdependencies import display_time
+from DEdependencies import load_drawing_index
+from DEdependencies import normalize_drawing_number
+from DEdependencies import load_page_manifest
+from DEdependencies import write_sorted_pdf
+from DEdependencies import emit_event
 
 # ---------------------- Directories ----------------------
-dirpath = Path(__file__).parent.as_posix()
+dirpath = job_root().as_posix()      # Job-scoped working root (PDFSORTER_JOB_ROOT), the script directory by default
 
 input_directory = Path(f"{dirpath}/PDFsToProcess")
 index_directory = Path(f"{dirpath}/_workingdata_/_indexdataset_/combined_data")
@@ -95,6 +100,9 @@ for maybe_drawing_no in unprocessed_sheet_list:
 sorted_page_numbers = []
 missing_drawings = []
 found_drawings = []
+duplicate_drawings = {}     # Reported once per drawing number, even if the reference list repeats it
+
+drawing_index = load_drawing_index(index_directory / "combined_drawing_numbers_dataset.csv")     # Read once, drawing number -> page numbers
 
 print("-" * 75)
 print("Sorting Input PDF(s) according to csv index")
@@ -104,31 +112,17 @@ print("")
 # Loop through each drawing number from airtable in the desired order
 for i in range(len(processed_sheet_list)):
     drawingno = processed_sheet_list[i]         # The actual data is in the 'fields' key
-    drawing_found = False       # Flag to track if we found this drawing in the CSV
-    
-    with open(f"{index_directory}/combined_drawing_numbers_dataset.csv", 'r', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['pdf_name', 'page_number', 'drawing_number', 'A_or_G']
-        reader = csv.DictReader(csvfile, fieldnames=fieldnames)
-
-        next(reader, None)      # Skip the header row if it exists
-
-        # Look through each row in the CSV for matching drawing number
-        for row in reader:
-            page_number = row['page_number']
-            scanned_drawing_number = row["drawing_number"]
-
-            # Check if this CSV row matches our current airtable drawing number
-            if scanned_drawing_number.strip() == drawingno.strip():
-                # Found a match - add this page number to our sorted list
-                sorted_page_numbers.append(int(page_number))
-                found_drawings.append(drawingno)
-                drawing_found = True
-
-                printProgressBar(i, len(processed_sheet_list))
-                # print(f"  -> Found on page {page_number}")
-                break  # Stop searching once we found the match
-    
-    if not drawing_found:
+    pages = drawing_index.get(normalize_drawing_number(drawingno))
+
+    if pages:
+        # Found a match - add the first page with this number to our sorted list (same page the old first-match scan picked)
+        sorted_page_numbers.append(pages[0])
+        found_drawings.append(drawingno)
+        if len(pages) > 1:
+            duplicate_drawings[drawingno] = pages
+
+        printProgressBar(i, len(processed_sheet_list))
+    else:
         missing_drawings.append(drawingno)
         # print(f"{bcolors.WARNING}  -> WARNING: Drawing {drawingno} not found in CSV{bcolors.ENDC}")
 
@@ -141,49 +135,35 @@ print(f"{bcolors.WARNING}Missing from CSV: {len(missing_drawings)}{bcolors.ENDC}
 if missing_drawings:
     print(f"{bcolors.WARNING}Missing drawings: {', '.join(missing_drawings)}{bcolors.ENDC}")
 
+if duplicate_drawings:
+    print(f"{bcolors.WARNING}Drawing numbers found on more than one page, first page used: {', '.join(f'{drawingno} (pages {pages})' for drawingno, pages in duplicate_drawings.items())}{bcolors.ENDC}")
+
+emit_event('summary', total_drawings=len(processed_sheet_list), found_drawings=len(found_drawings),
+           missing_drawings=missing_drawings, duplicate_drawings=duplicate_drawings)
+
 # print(f"Page order for sorting: {sorted_page_numbers}")
 print("")
 
 # ---------------- Generating Sorted PDF -----------------
 
-input_pdf_files = list(input_directory.glob("*.pdf"))
+manifest = load_page_manifest()      # Pages are copied straight out of the original input PDFs
 
-if not input_pdf_files:
+if not manifest:
     print(f"{bcolors.FAIL}ERROR: No PDF files found in input directory{bcolors.ENDC}")
+    emit_event('error', message="No PDF files found in input directory")
 else:
-    for i in range(len(input_pdf_files)):
-        # Process the first PDF file found
-        input_pdf_path = input_pdf_files[i]
-        # print(f"\nProcessing PDF: {input_pdf_path.name}")
-
-        source_doc = pymupdf.open(input_pdf_path)
-        sorted_doc = pymupdf.open()
-        pages_added = 0
-
-        print("")
-        print("Saving Sorted PDF...")
-        print("")
-        
-        for page_num in sorted_page_numbers:
-            page_index = page_num - 1
-
-            if page_index < source_doc.page_count:
-                sorted_doc.insert_pdf(source_doc, from_page=page_index, to_page=page_index)
-                pages_added += 1
-                # print(f"Added page {page_num} to sorted PDF")
-            else:
-                print(f"{bcolors.WARNING}WARNING: Page {page_num} doesn't exist in source PDF (only has {source_doc.page_count} pages){bcolors.ENDC}")
-
-    output_filename = f"SORTED_{input_pdf_path.stem}.pdf"
+    print("")
+    print("Saving Sorted PDF...")
+    print("")
+
+    output_filename = "SORTED_combined.pdf"
     output_path = output_directory / output_filename
-    sorted_doc.save(output_path)
+    pages_added = write_sorted_pdf(sorted_page_numbers, manifest, output_path)
+
     print(f"{bcolors.OKGREEN}\nSorted PDF saved as: {output_filename}{bcolors.ENDC}")
     print(f"{bcolors.OKGREEN}Pages in sorted PDF: {pages_added}{bcolors.ENDC}")
     print("-" * 75)
 
-    source_doc.close()
-    sorted_doc.close()
-
     if pages_added > 0:
         successcount += 1
         total_pages_processed += pages_added
@@ -0,0 +1,278 @@
+import time
+import fitz
+import queue
+import threading
+import multiprocessing
+from collections import deque
+import numpy as np
+from DEdependencies import load_settings
+from DEdependencies import available_cores
+from DEdependencies import job_cpu_limit
+from DEdependencies import title_block_rect
+from DEdependencies import MUPDF_ERROR_PATTERN
+
+"""
+Page rendering for the OCR stages.
+PaddleOCR takes the same HxWx3 BGR uint8 array cv2.imread gives back, so instead of JPEG-encoding a pixmap, decoding it into PIL,
+saving Page{n}.jpg and reading it back with cv2.imread, pixmap_to_ndarray() wraps the pixmap's sample buffer as a NumPy array directly.
+No encode, no decode, no temp file, and no lossy JPEG round-trips on the crop the OCR has to read.
+
+Rendering is CPU-bound and every page is independent, so TitleBlockRenderer can spread it over a pool of render_workers processes.
+Each worker opens the document itself (only the path and page numbers are sent over) and renders its share of the pages,
+shards come back in page order and only a few shards per worker are in flight at a time. Only use it from a script with a __main__ guard, the pool is spawned.
+
+stream() runs the rendering on a producer thread that fills a bounded queue while the caller OCRs what is already rendered,
+so rendering and OCR overlap and a run costs roughly the slower of the two instead of their sum.
+pipeline_queue_depth caps how many rendered crops wait in memory.
+
+render_profile = gray renders the crops as single-channel grayscale without annotations, a third of the pixels of RGB to render,
+queue, pickle and send. They stay single-channel until OCRengine.engine_images() right in front of PaddleOCR.
+
+Broken pages are handled one at a time (render_page()): a page whose clip render raises is flattened, the whole page is rasterized
+and the clip cut out of that raster, and a page that renders but makes MuPDF report a critical error (MUPDF_ERROR_PATTERN) keeps its
+image with a note. Either way the note comes back in the error slot next to the image so the OCR stage can report the page,
+only a page that can't even be flattened comes back without an image.
+"""
+
+settings = load_settings()
+
+RENDER_WORKERS = settings.getint('render_workers', 1)       # 1 = render in-process, 0 = one worker per core
+PIPELINE_QUEUE_DEPTH = settings.getint('pipeline_queue_depth', 32)      # 0 = render and OCR take turns on one thread
+RENDER_PROFILE = settings.get('render_profile', 'rgb').strip().lower()      # rgb | gray
+
+# ------------------------- Custom Functions --------------------------
+
+class PixmapBuffer(np.ndarray):
+    """
+    ndarray over a pixmap's samples that holds on to the pixmap.
+    pix.samples_mv does NOT keep the pixmap alive, so every view handed out has to lead back to this object through .base
+    """
+    pass
+
+def pixmap_to_ndarray(pix, bgr=True):
+    """
+    Zero-copy view of a pixmap as a NumPy array
+
+    Args:
+        pix (fitz.Pixmap): Rendered pixmap (no alpha)
+        bgr (bool): Flip RGB to the BGR order OpenCV/PaddleOCR expect (still a view, just a negative channel stride)
+
+    Returns:
+        numpy.ndarray: HxWx3 uint8 array (HxW for grayscale) sharing memory with the pixmap
+    """
+    holder = np.ndarray.__new__(
+        PixmapBuffer,
+        (pix.height, pix.width, pix.n),
+        np.uint8,
+        buffer=pix.samples_mv,
+        strides=(pix.stride, pix.n, 1)
+    )
+    holder.pixmap = pix
+
+    img = np.asarray(holder)        # Plain ndarray for the engine, its .base keeps the pixmap alive
+    if pix.n == 1:
+        img = img[..., 0]
+    elif bgr and pix.n == 3:
+        img = img[..., ::-1]
+    return img
+
+def render_title_block(page, pdfdpi=72, imgdpi=300, profile=RENDER_PROFILE, clip=None):
+    """
+    Renders only the title block clip of a page straight into an OCR-ready array
+
+    Args:
+        page (fitz.Page): PyMuPDF page object, rotation left as is
+        pdfdpi (int): DPI of the pdf you want to convert from
+        imgdpi (int): DPI of the image you want as output
+        profile (str): 'rgb' or 'gray' (single channel, annotations skipped)
+        clip (fitz.Rect): Area to render in displayed coordinates, defaults to title_block_rect(page) (see TitleBlockLocator.py)
+
+    Returns:
+        numpy.ndarray: BGR (or grayscale) view of the title block pixmap
+    """
+    if clip is None:
+        clip = title_block_rect(page)
+    mat = fitz.Matrix(imgdpi/pdfdpi, imgdpi/pdfdpi)
+    if profile == 'gray':
+        pix = page.get_pixmap(matrix=mat, clip=clip, colorspace=fitz.csGRAY, alpha=False, annots=False)
+    else:
+        pix = page.get_pixmap(matrix=mat, clip=clip, alpha=False)
+    return pixmap_to_ndarray(pix)
+
+def render_flattened(page, pdfdpi=72, imgdpi=300, profile=RENDER_PROFILE, clip=None):
+    """
+    Flattens a broken page: rasterizes the whole page and cuts the title block clip out of that raster
+
+    Args: same as render_title_block()
+    """
+    if clip is None:
+        clip = title_block_rect(page)
+    mat = fitz.Matrix(imgdpi/pdfdpi, imgdpi/pdfdpi)
+    if profile == 'gray':
+        page_pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False, annots=False)
+    else:
+        page_pix = page.get_pixmap(matrix=mat, alpha=False)
+
+    irect = ((clip & page.rect) * mat).irect & page_pix.irect      # Same pixel rounding as get_pixmap(clip=)
+    pix = fitz.Pixmap(page_pix.colorspace, irect, False)
+    pix.copy(page_pix, irect)
+    return pixmap_to_ndarray(pix)
+
+def render_page(page, imgdpi=300, clip=None):
+    """
+    render_title_block() with per-page repair for broken pages
+
+    Returns:
+        tuple: (image, note), note is None for a clean page, what went wrong (and whether it was flattened) otherwise
+
+    Raises:
+        Exception: The page couldn't even be flattened
+    """
+    fitz.TOOLS.mupdf_warnings()         # Reading resets, what comes after belongs to this page
+    try:
+        img = render_title_block(page, 72, imgdpi, clip=clip)
+    except Exception as e:
+        return render_flattened(page, 72, imgdpi, clip=clip), f"render failed ({str(e)}), flattened"
+
+    page_warnings = fitz.TOOLS.mupdf_warnings()
+    if page_warnings and MUPDF_ERROR_PATTERN.search(page_warnings):
+        return img, f"MuPDF error while rendering: {' | '.join(page_warnings.splitlines()[-3:])}"
+    return img, None
+
+render_docs = {}        # The documents a render worker process has open, by path
+
+def render_worker_page(job):
+    """
+    Pool task: renders one title block in a render worker, returns (page_num, image, error or note)
+    """
+    pdf_path, page_num, imgdpi, clip = job
+    try:
+        doc = render_docs.get(pdf_path)
+        if doc is None:
+            for open_doc in render_docs.values():       # Files are rendered one after another, keep only the current one open
+                open_doc.close()
+            render_docs.clear()
+            doc = render_docs[pdf_path] = fitz.open(pdf_path)
+
+        page = doc[page_num]
+        img, note = render_page(page, imgdpi, fitz.Rect(clip) if clip else None)
+        return page_num, img, note
+    except Exception as e:
+        return page_num, None, str(e)
+
+def render_worker_shard(pdf_path, page_nums, imgdpi, clips):
+    """
+    Pool task: renders a shard of consecutive pages, returns [(page_num, image, error), ...]
+    """
+    return [render_worker_page((pdf_path, page_num, imgdpi, clip)) for page_num, clip in zip(page_nums, clips)]
+
+class TitleBlockRenderer:
+    """
+    Renders title block crops of a list of pages, in-process or in a pool of worker processes.
+    render() yields (page_num, image, error) in the order the pages were given either way, stream() does the same from a producer thread.
+error is None for a clean page, a note next to an image for a broken page render_page() got through, and the error with image None otherwise.
+    """
+    def __init__(self, workers=RENDER_WORKERS, imgdpi=300):
+        if workers <= 0:
+            workers = available_cores()
+        elif job_cpu_limit():
+            workers = min(workers, available_cores())       # Stay inside the job's share of cores (JobQueue.py)
+        self.workers = workers
+        self.imgdpi = imgdpi
+        self.pool = None        # Started on the first document that has enough pages to spread out
+        self.description = f"{workers} render worker(s)" if workers > 1 else "in-process render"
+        self.wait_time = 0.0        # Seconds stream() consumers sat waiting on a render, > 0 means rendering is the slower stage
+
+    def render(self, doc, page_nums, imgdpi=None, clips=None):
+        """
+        Args:
+            doc (fitz.Document): Open source document, never modified
+            page_nums (list): 0-based page numbers to render
+            imgdpi (int): Render DPI for this call, defaults to the renderer's
+            clips (dict): page_num -> fitz.Rect to render, pages not in it get title_block_rect()
+        """
+        imgdpi = imgdpi or self.imgdpi
+        clips = clips or {}
+        if self.workers <= 1 or len(page_nums) < 2 * self.workers:        # Pool start up isn't worth it for a handful of pages
+            for page_num in page_nums:
+                try:
+                    img, note = render_page(doc[page_num], imgdpi, clips.get(page_num))
+                    yield page_num, img, note
+                except Exception as e:
+                    yield page_num, None, str(e)
+            return
+
+        if self.pool is None:
+            self.pool = multiprocessing.get_context('spawn').Pool(processes=self.workers)
+
+        shard_size = max(1, min(16, len(page_nums) // (self.workers * 4)))     # Small enough to keep every worker busy to the end
+        in_flight = deque()
+        for i in range(0, len(page_nums), shard_size):
+            shard = page_nums[i:i + shard_size]
+            shard_clips = [tuple(clips[page_num]) if page_num in clips else None for page_num in shard]      # Plain tuples pickle cheaper than Rects
+            in_flight.append(self.pool.apply_async(render_worker_shard, (doc.name, shard, imgdpi, shard_clips)))
+            if len(in_flight) >= self.workers * 2:          # Bounded, rendered crops don't pile up faster than they are picked up
+                yield from in_flight.popleft().get()
+        while in_flight:
+            yield from in_flight.popleft().get()
+
+    def stream(self, doc, page_nums, imgdpi=None, clips=None, depth=PIPELINE_QUEUE_DEPTH):
+        """
+        render() on a producer thread, through a queue of at most depth crops
+
+        Args:
+            doc (fitz.Document): Open source document, not to be touched by the caller until the stream is exhausted or closed
+            page_nums (list): 0-based page numbers to render
+            imgdpi (int): Render DPI for this call, defaults to the renderer's
+            clips (dict): page_num -> fitz.Rect to render, pages not in it get title_block_rect()
+            depth (int): Queue size (0 = no thread, same as render())
+        """
+        if depth <= 0:
+            yield from self.render(doc, page_nums, imgdpi, clips)
+            return
+
+        rendered = queue.Queue(maxsize=depth)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    rendered.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False        # Consumer went away
+
+        def produce():
+            try:
+                for item in self.render(doc, page_nums, imgdpi, clips):
+                    if not put(item):
+                        return
+            except Exception as e:
+                put(e)          # Re-raised on the consumer side
+            put(done)
+
+        producer = threading.Thread(target=produce, name="title-block-render", daemon=True)
+        producer.start()
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                item = rendered.get()
+                self.wait_time += time.perf_counter() - wait_start
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+# -------------------------------- END --------------------------------
@@ -0,0 +1,416 @@
+import os
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+import json
+import time
+import shutil
+import secrets
+import argparse
+import subprocess
+import threading
+from pathlib import Path
+from datetime import datetime
+from DEdependencies import bcolors
+from DEdependencies import display_time
+from DEdependencies import fingerprint_pdf_set
+from DEdependencies import index_settings_tag
+from DEdependencies import load_settings
+from DEdependencies import stored_index_path
+from DEdependencies import JOB_ROOT_ENV
+from OCRcache import ocr_engine_version
+
+"""
+The sorting pipeline without the GUI: copy the input PDFs in, run the stage scripts in order, collect the sorted PDF.
+ApplicationManager.py runs it on its worker thread and draws what the callbacks hand it, and this file is also a headless CLI
+for batch servers (no display, no tkinter start up), writing a JSON run report with per-stage timings, exit codes,
+page counts and the found / missing drawings:
+
+    python PipelineRunner.py path/to/pdfs --csv reference.csv --report run.json
+    python PipelineRunner.py path/to/pdfs --airtable "https://airtable.com/appXXX/tblXXX/viwXXX" --output path/to/out
+
+Every stage runs as its own process with PDFSORTER_EVENTS set and reports through the JSON-line events on stderr (DEdependencies.emit_event).
+The Airtable URL goes to PDFpageSorter.py through PDFSORTER_AIRTABLE_URL instead of rewriting the script's source.
+Every job works in its own root (PDFSORTER_JOB_ROOT, see DEdependencies.job_root()), the CLI makes a fresh one under _jobs_ per run
+and removes it afterwards, so several sorts can run on one machine at the same time. The GUI keeps using the script directory.
+With --ocr-worker the model is loaded once in an OCR worker that lives as long as the run: own free port, own key, stopped at the end,
+so concurrent runs never fight over ocr_worker_port. If it can't start the OCR stage loads PaddleOCR in-process as usual.
+A re-sort of the same PDFs with the same OCR settings reuses the index stored by the last complete OCR run, --force-ocr OCRs them again.
+Exit code 0 = sorted, 1 = a stage failed, 2 = bad arguments.
+"""
+
+SCRIPT_DIR = Path(__file__).parent
+AIRTABLE_URL_ENV = 'PDFSORTER_AIRTABLE_URL'
+SORTED_PDF_NAME = "SORTED_combined.pdf"
+
+# ------------------------- Custom Functions --------------------------
+
+def prepare_pdfs(source_dir, job_dir=SCRIPT_DIR):
+    """
+    Copy PDFs from the input directory to the job's PDFsToProcess, returns how many were copied
+    """
+    dest_dir = Path(job_dir) / "PDFsToProcess"
+    dest_dir.mkdir(parents=True, exist_ok=True)     # Create directory if it doesn't exist
+
+    for file in dest_dir.glob("*.pdf"):     # Clear existing files
+        file.unlink()
+
+    pdf_count = 0
+    for pdf_file in Path(source_dir).glob("*.pdf"):
+        shutil.copy2(pdf_file, dest_dir)
+        pdf_count += 1
+    return pdf_count
+
+def prepare_csv(source_csv, job_dir=SCRIPT_DIR):
+    """
+    Copy the reference CSV to the job's ReferenceCSV/reference.csv
+    """
+    dest_dir = Path(job_dir) / "ReferenceCSV"
+    dest_dir.mkdir(parents=True, exist_ok=True)
+
+    for file in dest_dir.glob("*.csv"):
+        file.unlink()
+
+    shutil.copy2(source_csv, dest_dir / "reference.csv")
+
+def working_index_path(job_dir=SCRIPT_DIR):
+    """
+    Path of the combined index the sorter scripts read
+    """
+    return Path(job_dir) / "_workingdata_" / "_indexdataset_" / "combined_data" / "combined_drawing_numbers_dataset.csv"
+
+def copy_atomic(source, destination):
+    """
+    Copy through a temporary file next to destination and swap it in with os.replace(), so destination is either
+    missing or complete, never half written (a crashed copy, or another job copying to it at the same time)
+    """
+    destination = Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = destination.with_name(f".{destination.name}.{os.getpid()}.tmp")
+    try:
+        shutil.copy2(source, temp_path)
+        os.replace(temp_path, destination)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+def restore_index(fingerprint, job_dir=SCRIPT_DIR):
+    """
+    Copy the stored index of an identical input set into _workingdata_, returns True if there was one
+    Stored indexes only ever appear complete (see store_index()), a restore that fails leaves no index behind and OCR runs as usual
+    """
+    stored_index = stored_index_path(fingerprint)
+    if not stored_index.is_file():
+        return False
+
+    try:
+        copy_atomic(stored_index, working_index_path(job_dir))
+    except OSError as e:
+        print(f"{bcolors.WARNING}Could not restore the stored index, running OCR: {str(e)}{bcolors.ENDC}", flush=True)
+        return False
+    return True
+
+def store_index(fingerprint, job_dir=SCRIPT_DIR):
+    """
+    Keep the freshly built index so a re-sort of the same PDFs can skip OCR, returns True if it was stored
+    """
+    working_index = working_index_path(job_dir)
+    if not working_index.exists():
+        return False
+
+    copy_atomic(working_index, stored_index_path(fingerprint))
+    return True
+
+def pipeline_stages(sorter_script, resort_only):
+    """
+    Stage scripts in order with the overall progress range each one covers and its status text
+
+    Returns:
+        list: [(script, start_progress, end_progress, status), ...]
+    """
+    if resort_only:
+        return [
+            ("PDFcombiner.py", 0, 50, "Building page manifest..."),
+            (sorter_script, 50, 100, "Re-sorting PDFs with stored index...")
+        ]
+    return [
+        ("PDFcombiner.py", 0, 20, "Building page manifest..."),
+        ("TitleBlockOCR.py", 20, 80, "Running OCR on title blocks..."),
+        (sorter_script, 80, 100, "Sorting PDFs...")
+    ]
+
+def run_stage(script_name, on_output=None, on_event=None, env=None, job_dir=SCRIPT_DIR):
+    """
+    Runs one stage script. stdout goes to on_output line by line, the JSON-line events on stderr go to on_event
+    (anything else on stderr, like a traceback, goes to on_output too)
+
+    Args:
+        script_name (str): Stage script next to this file
+        on_output (callable): on_output(text)
+        on_event (callable): on_event(event dict)
+        env (dict): Extra environment variables for the stage
+        job_dir (Path): Working root of the job (PDFSORTER_JOB_ROOT of the stage)
+
+    Returns:
+        dict: {'script', 'returncode', 'seconds', 'success', 'errors', 'warnings', 'summary', 'stderr_tail'}
+    """
+    on_output = on_output or (lambda text: None)
+    on_event = on_event or (lambda event: None)
+    result = {'script': script_name, 'returncode': None, 'seconds': 0.0, 'success': False,
+              'errors': [], 'warnings': 0, 'summary': None, 'stderr_tail': []}
+    start_time = time.time()
+
+    process = subprocess.Popen(
+        [sys.executable, str(SCRIPT_DIR / script_name)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+        cwd=str(SCRIPT_DIR),
+        encoding='utf-8',
+        errors='replace',  # Replace invalid characters instead of failing
+        env={**os.environ, **(env or {}), 'PDFSORTER_EVENTS': "1", JOB_ROOT_ENV: str(Path(job_dir).resolve())}
+    )
+
+    def read_events():
+        for line in process.stderr:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                event = None
+
+            if not isinstance(event, dict) or 'event' not in event:
+                if line.strip():
+                    result['stderr_tail'] = (result['stderr_tail'] + [line.rstrip()])[-20:]
+                    on_output(line)
+                continue
+
+            if event['event'] == 'error':
+                result['errors'].append(event.get('message', ''))
+            elif event['event'] == 'warning':
+                result['warnings'] += 1
+            elif event['event'] == 'summary':
+                result['summary'] = {key: value for key, value in event.items() if key != 'event'}
+            on_event(event)
+
+    # Events come in on their own thread so a full stderr pipe can never stall the script
+    event_thread = threading.Thread(target=read_events, daemon=True)
+    event_thread.start()
+
+    for line in process.stdout:
+        if line:
+            on_output(line)
+
+    process.wait()
+    event_thread.join()
+
+    result['returncode'] = process.returncode
+    result['seconds'] = round(time.time() - start_time, 2)
+    result['success'] = process.returncode == 0 and not result['errors']       # Warnings never fail a stage
+    return result
+
+def start_run_ocr_worker():
+    """
+    Starts an OCR worker for one CLI run on a free port with a fresh key (set in os.environ, the stages inherit both)
+
+    Returns:
+        tuple: (subprocess.Popen, port), or None if the worker couldn't start and OCR has to load in-process
+    """
+    from OCRengine import ensure_ocr_worker, free_port, OCR_WORKER_KEY_ENV
+    port = free_port()
+    os.environ[OCR_WORKER_KEY_ENV] = secrets.token_hex(16)
+    os.environ['PDFSORTER_OCR_PORT'] = str(port)
+    try:
+        process = ensure_ocr_worker(port=port)
+        if process is not None:
+            return process, port
+    except Exception as e:
+        print(f"{bcolors.WARNING}OCR worker unavailable, OCR will load in-process: {str(e)}{bcolors.ENDC}", flush=True)
+    os.environ.pop(OCR_WORKER_KEY_ENV, None)
+    os.environ.pop('PDFSORTER_OCR_PORT', None)
+    return None
+
+def stop_run_ocr_worker(worker):
+    """
+    Shuts down the worker start_run_ocr_worker() started
+    """
+    from OCRengine import stop_ocr_worker
+    process, port = worker
+    stop_ocr_worker(port)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def collect_sorted_pdf(output_dir, job_dir=SCRIPT_DIR):
+    """
+    Moves the sorted PDF out of the job's SortedPDFs into output_dir, returns its new path (None if the sorter made none)
+    """
+    sorted_dir = Path(job_dir) / "SortedPDFs"
+    sorted_pdfs = [f for f in sorted_dir.iterdir() if f.suffix.lower() == '.pdf'] if sorted_dir.exists() else []
+    if not sorted_pdfs:
+        return None
+
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    output_path = Path(output_dir) / SORTED_PDF_NAME
+    shutil.move(str(sorted_pdfs[0]), str(output_path))
+    shutil.rmtree(sorted_dir)
+    return output_path
+
+def run_pipeline(input_dir, airtable_url=None, csv_path=None, output_dir=None,
+                 on_output=None, on_event=None, on_stage=None, before_ocr=None, job_dir=SCRIPT_DIR, force_ocr=False):
+    """
+    Runs the whole sort, returns the run report
+
+    Args:
+        input_dir (Path): Directory holding the drawing set PDFs
+        airtable_url (str): Airtable view with the reference order (PDFpageSorter.py), or
+        csv_path (Path): Reference CSV with the order (PDFpageSortercsv.py)
+        output_dir (Path): Where SORTED_combined.pdf ends up, defaults to input_dir
+        on_output (callable): on_output(text), every line the stages print
+        on_event (callable): on_event(script, start_progress, end_progress, event)
+        on_stage (callable): on_stage(script, start_progress, end_progress, status), before each stage
+        before_ocr (callable): Called once before the OCR stage (the GUI starts its OCR worker here)
+        job_dir (Path): Working root of this job, the script directory (shared layout) by default
+        force_ocr (bool): Run OCR even if an index for these PDFs is stored
+
+    Returns:
+        dict: JSON-serializable run report
+    """
+    on_output = on_output or (lambda text: None)
+    output_dir = Path(output_dir or input_dir)
+    start_time = time.time()
+    report = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'input_dir': str(Path(input_dir).resolve()),
+        'job_dir': str(Path(job_dir).resolve()),
+        'reference': {'airtable': airtable_url} if airtable_url else {'csv': str(csv_path)},
+        'success': False,
+        'stages': [],
+        'sorted_pdf': None
+    }
+
+    pdf_count = prepare_pdfs(input_dir, job_dir)
+    report['input_pdfs'] = pdf_count
+    on_output(f"Copied {pdf_count} PDF(s) to processing directory\n")
+
+    stage_env = {}
+    if airtable_url:
+        stage_env[AIRTABLE_URL_ENV] = airtable_url
+        sorter_script = "PDFpageSorter.py"
+    else:
+        prepare_csv(csv_path, job_dir)
+        on_output("Copied reference CSV file\n")
+        sorter_script = "PDFpageSortercsv.py"
+
+    # Same input PDFs and OCR settings as an earlier run? Then only the reference order changed and the stored index can be reused
+    ocr_tag = f"{index_settings_tag(load_settings())}|{ocr_engine_version()}"
+    input_fingerprint = fingerprint_pdf_set(list((Path(job_dir) / "PDFsToProcess").glob("*.pdf")), ocr_tag)
+    report['resort_only'] = resort_only = not force_ocr and restore_index(input_fingerprint, job_dir)
+    report['index_stored'] = False
+
+    for script, start_progress, end_progress, status in pipeline_stages(sorter_script, resort_only):
+        if script == "TitleBlockOCR.py" and before_ocr is not None:
+            before_ocr()
+        if on_stage is not None:
+            on_stage(script, start_progress, end_progress, status)
+
+        stage_event = (lambda event, script=script, start=start_progress, end=end_progress: on_event(script, start, end, event)) if on_event else None
+        stage = run_stage(script, on_output, stage_event, stage_env, job_dir)
+        report['stages'].append(stage)
+
+        if not stage['success']:
+            break
+
+        if script == "TitleBlockOCR.py" and not (stage['summary'] or {}).get('ocr_errors'):
+            report['index_stored'] = store_index(input_fingerprint, job_dir)     # Keep the index before the sorter cleans up _workingdata_, only a complete one
+    else:
+        sorted_pdf = collect_sorted_pdf(output_dir, job_dir)
+        report['sorted_pdf'] = str(sorted_pdf) if sorted_pdf else None
+        report['success'] = sorted_pdf is not None
+
+    summaries = {stage['script']: stage['summary'] or {} for stage in report['stages']}
+    report['pages'] = summaries.get("PDFcombiner.py", {}).get('pages')
+    sort_summary = summaries.get(sorter_script, {})
+    report['total_drawings'] = sort_summary.get('total_drawings')
+    report['found_drawings'] = sort_summary.get('found_drawings')
+    report['missing_drawings'] = sort_summary.get('missing_drawings', [])
+    report['duplicate_drawings'] = sort_summary.get('duplicate_drawings', {})
+    report['seconds'] = round(time.time() - start_time, 2)
+    return report
+
+# -------------------------------- END --------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Sort a drawing set by its reference order without the GUI")
+    parser.add_argument("input_dir", help="Directory holding the drawing set PDFs")
+    reference = parser.add_mutually_exclusive_group(required=True)
+    reference.add_argument("--airtable", metavar="URL", help="Airtable view URL with the reference order")
+    reference.add_argument("--csv", metavar="PATH", help="Reference CSV with the order (drawing numbers in the first column)")
+    parser.add_argument("--output", metavar="DIR", help="Where SORTED_combined.pdf goes (default: the input directory)")
+    parser.add_argument("--report", metavar="PATH", help="Write the JSON run report here")
+    parser.add_argument("--ocr-worker", action="store_true", help="Load the OCR model in an OCR worker for this run (stopped at the end)")
+    parser.add_argument("--force-ocr", action="store_true", help="OCR the PDFs even if an index for them is stored from an earlier run")
+    parser.add_argument("--job-dir", metavar="DIR", help="Working root for this job (default: a new directory under _jobs_, removed afterwards)")
+    parser.add_argument("--quiet", action="store_true", help="Don't echo the stage output")
+    args = parser.parse_args()
+
+    input_dir = Path(args.input_dir)
+    if not input_dir.is_dir():
+        parser.error(f"input directory not found: {input_dir}")
+    if args.csv and not Path(args.csv).is_file():
+        parser.error(f"reference CSV not found: {args.csv}")
+
+    def on_output(text):
+        if not args.quiet:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+    def on_stage(script, start_progress, end_progress, status):
+        print(f"\n{'=' * 86}\n{script}: {status}\n{'=' * 86}\n", flush=True)
+
+    ocr_worker = {}
+
+    def start_worker():
+        ocr_worker['worker'] = start_run_ocr_worker()
+
+    if args.job_dir:
+        job_dir = Path(args.job_dir)
+    else:
+        job_dir = SCRIPT_DIR / "_jobs_" / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    job_dir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        report = run_pipeline(input_dir, airtable_url=args.airtable, csv_path=args.csv, output_dir=args.output,
+                              on_output=on_output, on_stage=on_stage, before_ocr=start_worker if args.ocr_worker else None, job_dir=job_dir,
+                              force_ocr=args.force_ocr)
+    finally:
+        if ocr_worker.get('worker') is not None:
+            stop_run_ocr_worker(ocr_worker['worker'])
+        if not args.job_dir:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    if args.report:
+        Path(args.report).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    print("")
+    print("=" * 75)
+    for stage in report['stages']:
+        print(f"{stage['script']}: exit code {stage['returncode']} | {stage['seconds']:.2f} seconds | {len(stage['errors'])} error(s) | {stage['warnings']} warning(s)")
+    if report['success']:
+        print(f"{bcolors.OKGREEN}SORTED {report['found_drawings']} OF {report['total_drawings']} DRAWINGS IN {report['seconds']:.2f} SECOND(S) [{display_time(report['seconds'])}]{bcolors.ENDC}")
+        print(f"{bcolors.OKGREEN}Sorted PDF saved as: {report['sorted_pdf']}{bcolors.ENDC}")
+        if report['missing_drawings']:
+            print(f"{bcolors.WARNING}Missing drawings: {', '.join(str(drawing) for drawing in report['missing_drawings'])}{bcolors.ENDC}")
+    else:
+        print(f"{bcolors.FAIL}SORTING FAILED{bcolors.ENDC}")
+        for stage in report['stages']:
+            for error in stage['errors'] + stage['stderr_tail'][-1:]:
+                print(f"{bcolors.FAIL}{stage['script']}: {error}{bcolors.ENDC}")
+    print("=" * 75)
+
+    sys.exit(0 if report['success'] else 1)
+
+if __name__ == "__main__":
+    main()
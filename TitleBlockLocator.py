@@ -0,0 +1,299 @@
+import fitz
+from DEdependencies import title_block_rect
+from DEdependencies import title_block_text
+from DEdependencies import unrotated_clip
+from DEdependencies import extract_drawing_number
+
+"""
+Finds where the title block (and the drawing number in it) actually sits on a page.
+title_block_rect() crops fixed fractions of the mediabox, which misses the title block on plenty of sheets
+(different paper sizes, title block along the bottom instead of the right, centered mediaboxes), and every miss gets OCR'd for nothing.
+locate_title_block() tries, cheapest and tightest first:
+    1. label  - the "DRAWING NO" label in the text layer (bottom right quarter only, as displayed or as drawn), clip = the label and the text lines
+                next to / under it in its reading direction, or the ruled cell around it when the number isn't in the text layer
+    2. frame  - the smallest ruled cell of the title block frame in the bottom right corner, from the page's vector drawings
+    3. default - title_block_rect(), same crop as always
+Scans have neither a text layer nor vector drawings, so they end up on the default crop like before.
+A clip that reads nothing isn't the end of it: fallback_title_block() hands out the next method down the list, down to the default crop.
+Pages keep their rotation: the text layer and drawings come back in unrotated coordinates and are mapped through page.rotation_matrix,
+so every clip here is in displayed coordinates, "bottom right" means as the sheet is read, and get_pixmap(clip=) takes it as is.
+TitleBlockTemplates learns the clip per paper size + rotation from the first few pages that were read successfully
+and hands it out for every later page of that size, so the locator doesn't run on thousands of identical sheets.
+"""
+
+TITLE_BLOCK_LABELS = ("DRAWING NO", "DRAWING NUMBER", "DWG NO", "DWG. NO", "SHEET NO")
+TITLE_BLOCK_REGION = 0.5        # Labels count only when they sit in the last half of the width and of the height (drawing index headers, general notes)
+LABEL_REACH = (20, 4)           # How far from the label a text line may start and still belong to it, in label text heights: along the text, below it
+
+# ------------------------- Custom Functions --------------------------
+
+def in_title_block_region(rect, page_rect):
+    """
+    True if rect reaches into the last TITLE_BLOCK_REGION of page_rect's width and height
+    """
+    return (rect.x1 >= page_rect.x0 + page_rect.width * TITLE_BLOCK_REGION and
+            rect.y1 >= page_rect.y0 + page_rect.height * TITLE_BLOCK_REGION)
+
+def text_frame(rect, direction):
+    """
+    rect as (along, across) ranges in the reading frame of text running in direction (a text line's 'dir'),
+    along grows in reading direction, across grows downwards as the text is read
+    """
+    cos, sin = direction
+    corners = [(point.x * cos + point.y * sin, point.y * cos - point.x * sin) for point in (rect.tl, rect.tr, rect.bl, rect.br)]
+    along = [corner[0] for corner in corners]
+    across = [corner[1] for corner in corners]
+    return (min(along), max(along)), (min(across), max(across))
+
+def frame_rect(along, across, direction):
+    """
+    Inverse of text_frame(), (along, across) ranges back to a page rect
+    """
+    cos, sin = direction
+    corners = [fitz.Point(a * cos - c * sin, a * sin + c * cos) for a in along for c in across]
+    rect = fitz.Rect(corners[0], corners[0])
+    for corner in corners[1:]:
+        rect |= corner
+    return rect
+
+def label_lines(page, label_rect):
+    """
+    The text layer lines that belong with a label: its own line and the lines starting next to it or just under it
+    as the label is read, so a drawing number in a bigger font or on the next line comes out whole
+
+    Args:
+        page (fitz.Page): PyMuPDF page object, rotation left as is
+        label_rect (fitz.Rect): search_for() hit of the label, unrotated coordinates
+
+    Returns:
+        tuple: (list of line bboxes in unrotated coordinates, label text height, label line direction), None if the label isn't on a text line
+    """
+    lines = [line for block in page.get_text("dict")['blocks'] for line in block.get('lines', ())]
+    label_line = next((line for line in lines if fitz.Rect(line['bbox']).intersects(label_rect)), None)
+    if label_line is None:
+        return None
+
+    direction = label_line['dir']
+    (along0, along1), (across0, across1) = text_frame(label_rect, direction)
+    h = across1 - across0           # Text height, measured across the text whichever way the label runs on the sheet
+    reach_along, reach_across = LABEL_REACH
+
+    found = []
+    for line in lines:
+        if max(abs(line['dir'][0] - direction[0]), abs(line['dir'][1] - direction[1])) > 0.1:
+            continue        # Different writing direction, not part of this label's field
+        (line_along0, line_along1), (line_across0, line_across1) = text_frame(fitz.Rect(line['bbox']), direction)
+        if (line_along1 >= along0 - h and line_along0 <= along1 + reach_along * h and
+                line_across1 >= across0 - h / 2 and line_across0 <= across1 + reach_across * h):
+            found.append(fitz.Rect(line['bbox']))
+    return found, h, direction
+
+def label_cell(page, label_rect):
+    """
+    Smallest ruled rect of the page's drawings around a label (its title block cell), None if it isn't in one
+
+    Args:
+        page (fitz.Page): PyMuPDF page object, rotation left as is
+        label_rect (fitz.Rect): Label, unrotated coordinates
+    """
+    half_page = page.mediabox.get_area() / 2
+    best = None
+    for path in page.get_drawings():
+        rect = path['rect']
+        if rect.contains(label_rect) and rect.get_area() < half_page:
+            if best is None or rect.get_area() < best.get_area():
+                best = rect
+    return best
+
+def number_complete(page, clip, drawing_number):
+    """
+    False if the drawing number read from clip is the cut off start or end of a longer word of the text layer
+    (a word running over the clip's edge that contains it), True otherwise, also when the text layer doesn't have it (scans)
+
+    Args:
+        page (fitz.Page): PyMuPDF page object, rotation left as is
+        clip (fitz.Rect): Clip the number was read from, displayed coordinates
+        drawing_number (str): What was read
+    """
+    if not drawing_number:
+        return False
+    text_clip = unrotated_clip(page, clip)
+    for word in page.get_text("words", clip=text_clip + (-1, -1, 1, 1)):      # Words touching the clip, some may reach past it
+        word_rect, text = fitz.Rect(word[:4]), word[4].upper()
+        if not text_clip.contains(word_rect) and drawing_number in text and drawing_number != text.rstrip('.,;:'):
+            return False
+    return True
+
+def locate_by_label(page):
+    """
+    Clip around the drawing number label and the number next to / under it, None if the page has no such text
+    or the clip would cut the number in the text layer off
+
+    Args:
+        page (fitz.Page): PyMuPDF page object, rotation left as is
+    """
+    displayed_rect = page.rect
+    unrotated_rect = page.rect * page.derotation_matrix      # Sheets drawn sideways under /Rotate have the title block bottom right of this one
+
+    hits = []
+    for label in TITLE_BLOCK_LABELS:
+        for hit in page.search_for(label):          # Case-insensitive, unrotated coordinates
+            displayed_hit = hit * page.rotation_matrix
+            if in_title_block_region(hit, unrotated_rect) or in_title_block_region(displayed_hit, displayed_rect):
+                hits.append((displayed_hit, hit))
+    if not hits:
+        return None
+
+    label_rect = max(hits, key=lambda hit: hit[0].x1 + hit[0].y1)[1]       # Furthest bottom right as displayed, the title block one
+    found = label_lines(page, label_rect)
+    if found is None:
+        return None
+    lines, h, direction = found
+
+    clip = fitz.Rect(label_rect)        # Label and the lines around it, the number is one of them when the text layer has it
+    for line in lines:
+        clip |= line
+    clip = (clip + (-h, -h, h, h)) * page.rotation_matrix & page.rect
+    if clip.is_empty:
+        return None
+    drawing_number = extract_drawing_number(title_block_text(page, clip))
+    if drawing_number:
+        return clip if number_complete(page, clip, drawing_number) else None
+
+    # Number isn't in the text layer (outlined text), OCR the box the label sits in, or everywhere the number could start
+    clip = label_cell(page, label_rect)
+    if clip is None:
+        (along0, along1), (across0, across1) = text_frame(label_rect, direction)
+        reach_along, reach_across = LABEL_REACH
+        clip = frame_rect((along0 - h, along1 + 2 * reach_along * h), (across0 - h, across1 + 2 * reach_across * h), direction)     # Room for the whole number
+    clip = clip * page.rotation_matrix & page.rect
+    return None if clip.is_empty else clip
+
+def locate_by_frame(page):
+    """
+    Smallest ruled cell touching the bottom right corner of the page (usually the drawing / sheet number box), None if there isn't one
+
+    Args:
+        page (fitz.Page): PyMuPDF page object, rotation left as is
+    """
+    page_rect = page.rect
+    width, height = page_rect.width, page_rect.height
+
+    best = None
+    for path in page.get_drawings():
+        rect = path['rect'] * page.rotation_matrix
+        if not (rect.x1 >= page_rect.x0 + width * 0.90 and rect.y1 >= page_rect.y0 + height * 0.90):
+            continue        # Not in the corner
+        if not (width * 0.05 <= rect.width <= width * 0.50 and height * 0.03 <= rect.height <= height * 0.50):
+            continue        # Border of the whole sheet, or a tick mark
+        if best is None or rect.get_area() < best.get_area():
+            best = rect
+
+    if best is None:
+        return None
+    best &= page_rect
+    return None if best.is_empty else best
+
+def locate_title_block(page, skip=()):
+    """
+    Clip rect of the title block on a page and how it was found
+
+    Args:
+        page (fitz.Page): PyMuPDF page object, rotation left as is
+        skip (set): Methods not to try ('label', 'frame'), the default crop is always there
+
+    Returns:
+        tuple: (fitz.Rect, 'label' | 'frame' | 'default')
+    """
+    if 'label' not in skip:
+        clip = locate_by_label(page)
+        if clip is not None:
+            return clip, 'label'
+
+    if 'frame' not in skip:
+        clip = locate_by_frame(page)
+        if clip is not None:
+            return clip, 'frame'
+
+    return title_block_rect(page), 'default'
+
+def fallback_title_block(page, clip, tried):
+    """
+    Next clip to try after clip read nothing, None once the default crop was tried
+
+    Args:
+        page (fitz.Page): PyMuPDF page object, rotation left as is
+        clip (fitz.Rect): Clip that read nothing
+        tried (set): Methods tried on this page so far ('template' | 'label' | 'frame' | 'default'), the returned one is added
+
+    Returns:
+        tuple: (fitz.Rect, method) or None
+    """
+    while 'default' not in tried:
+        next_clip, method = locate_title_block(page, skip=tried)
+        tried.add(method)
+        if next_clip != clip:
+            return next_clip, method
+    return None
+
+class TitleBlockTemplates:
+    """
+    Learned title block clips, keyed by page signature (mediabox width, height, rotation).
+    The first learn_pages successful clips of a signature are merged (union) into its template,
+    until then pages of that signature go through locate_title_block() as usual.
+    """
+    def __init__(self, learn_pages=3):
+        self.learn_pages = max(1, learn_pages)
+        self.samples = {}           # signature -> clips collected so far
+        self.templates = {}         # signature -> learned clip
+
+    @staticmethod
+    def signature(page):
+        """
+        (width, height, rotation) of a page
+
+        Args:
+            page (fitz.Page): PyMuPDF page object
+        """
+        mediabox = page.mediabox
+        return (round(mediabox.width), round(mediabox.height), page.rotation)
+
+    def locate(self, page, signature):
+        """
+        Template clip if the signature has one, otherwise locate_title_block()
+
+        Args:
+            page (fitz.Page): PyMuPDF page object, rotation left as is
+            signature (tuple): signature() of the page
+
+        Returns:
+            tuple: (fitz.Rect, 'template' | 'label' | 'frame' | 'default')
+        """
+        template = self.templates.get(signature)
+        if template is not None:
+            clip = template & page.rect
+            if not clip.is_empty:
+                return clip, 'template'
+        return locate_title_block(page)
+
+    def learn(self, signature, clip):
+        """
+        Records a clip the drawing number was read from, builds the template once enough are in
+        Only pass clips that read the whole number (number_complete()), a template that cuts it off is used for every later page
+
+        Args:
+            signature (tuple): signature() of the page
+            clip (fitz.Rect): clip that worked
+        """
+        if signature in self.templates:
+            return
+        samples = self.samples.setdefault(signature, [])
+        samples.append(fitz.Rect(clip))
+        if len(samples) >= self.learn_pages:
+            template = fitz.Rect(samples[0])
+            for sample in samples[1:]:
+                template |= sample
+            self.templates[signature] = template
+            del self.samples[signature]
+
+# -------------------------------- END --------------------------------
@@ -0,0 +1,351 @@
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+import fitz
+import time
+from pathlib import Path
+from OCRengine import LazyOCR
+from OCRengine import OCRBatcher
+from PDFrender import TitleBlockRenderer
+from PDFrender import RENDER_PROFILE
+from OCRcache import OCRCache
+from TitleBlockLocator import fallback_title_block
+from TitleBlockLocator import TitleBlockTemplates
+from TitleBlockLocator import number_complete
+from DEdependencies import bcolors
+from DEdependencies import printProgressBar
+from DEdependencies import job_root
+from DEdependencies import display_time
+from DEdependencies import load_settings
+from DEdependencies import title_block_rect
+from DEdependencies import title_block_text
+from DEdependencies import extract_drawing_number
+from DEdependencies import dataset_row
+from DEdependencies import ocr_dataset_row
+from DEdependencies import ocr_drawing_number_score
+from DEdependencies import write_dataset_csv
+from DEdependencies import load_page_manifest
+from DEdependencies import emit_event
+
+"""     #1-3 (fused)
+ExpandedPDFdrawingNumberCrop.py -> cropToJPEGcachePDF.py -> CacheOCR.py in a single pass, over the input PDFs listed in the page manifest PDFcombiner.py writes.
+Those three scripts write a crop manifest, render the clips into a JPEG-only PDF (_pdfcache_)
+and then render it AGAIN into Page{n}.jpg files just so PaddleOCR can read them back. On big drawing sets that is tens of GB of disk writes before OCR even starts.
+This script opens the source pages directly, renders only the title block clip straight into memory and hands it to the OCR engine.
+Nothing is written to disk except the index datasets in _indexdataset_ (same format CacheOCR.py writes, so the sorters don't care which path made them).
+page_number in the datasets is the global page number from the manifest, which is what the sorters look pages up by.
+
+Pages are handled in two passes per file: text layer / OCR cache first, then every page that is left gets rendered and OCR'd.
+Rendering runs ahead on its own thread into a bounded queue (pipeline_queue_depth) so it overlaps with OCR,
+and with render_workers > 1 it runs in a process pool (spawned, hence the __main__ guard at the bottom).
+
+Every page's clip comes from TitleBlockLocator.py (drawing number label, title block frame, or the old fixed fractions),
+the same clip is used for the text layer, the OCR cache key and the render. Once the first title_block_learn_pages pages of a
+paper size + rotation were read successfully, their clip becomes the template for every later page of that size and the locator
+only runs again for pages the template clip fails on. A clip that OCRs to nothing gets one more round with the next one
+the locator has (label -> frame -> default crop), so a wrong label hit never does worse than the old fixed crop.
+
+Pages are first rendered at the lowest DPI of ocr_dpi_ladder. Only the ones where the regex cascade finds no drawing number,
+or finds one with a rec_score under ocr_min_score, are rendered again at the next DPI up. Clean title blocks read fine at 150 DPI,
+which is 4x fewer pixels to render and OCR than 300 DPI.
+
+Broken pages are handled one page at a time by PDFrender.render_page(): a clip that won't render is flattened, and a page MuPDF
+reports a critical error on is still OCR'd but reported (warning event), the rest of the file is never affected.
+"""
+
+# ------------------------- Custom Functions --------------------------
+
+def ocr_pages(renderer, batcher, doc, page_nums, imgdpi, clips, pdf_name, first_page):
+    """
+    Renders (on the renderer's producer thread) and OCRs pages at one DPI, in batches
+
+    Args:
+        renderer (TitleBlockRenderer): Renders the title block crops
+        batcher (OCRBatcher): Batches them into the OCR engine
+        doc (fitz.Document): Source document
+        page_nums (list): 0-based page numbers
+        imgdpi (int): Render DPI
+        clips (dict): page_num -> title block clip
+        pdf_name (str): Name the pages are keyed by
+        first_page (int): Global page number of the document's first page
+
+    Yields:
+        tuple: (page_num, ocr_data or None, render error or None)
+    """
+    for page_num, ocrimg, render_error in renderer.stream(doc, page_nums, imgdpi, clips):
+        if ocrimg is None:
+            yield page_num, None, render_error
+            continue
+        if render_error is not None:        # Broken page PDFrender got an image out of anyway, OCR it but say so
+            print(f"{bcolors.WARNING}  Page {page_num + 1} of {pdf_name}: {render_error}{bcolors.ENDC}")
+            emit_event('warning', message=f"Page {page_num + 1} of {pdf_name}: {render_error}")
+        for key, ocr_data in batcher.add((pdf_name, first_page + page_num), ocrimg):      # OCR runs once a full batch is queued
+            yield key[1] - first_page, ocr_data, None
+
+    for key, ocr_data in batcher.flush():       # Last partial batch
+        yield key[1] - first_page, ocr_data, None
+
+def main():
+    total_time_start = time.time()
+
+    settings = load_settings()
+    ocr_dpi = settings.getint('ocr_dpi', 300)
+    ocr_dpi_ladder = sorted(int(dpi) for dpi in settings.get('ocr_dpi_ladder', str(ocr_dpi)).split(','))     # Escalation steps, lowest first
+    ocr_min_score = settings.getfloat('ocr_min_score', 0.0)
+    ladder_tag = ','.join(str(dpi) for dpi in ocr_dpi_ladder) + f"@{ocr_min_score}/{RENDER_PROFILE}"     # Cached results depend on the whole ladder and the render profile
+    text_layer_fast_path = settings.getboolean('text_layer_fast_path', True)
+    title_block_locator = settings.getboolean('title_block_locator', True)
+    templates = TitleBlockTemplates(settings.getint('title_block_learn_pages', 3))     # Learned clips, shared by every file of the set
+
+    ocr_cache = OCRCache() if settings.getboolean('ocr_cache', True) else None     # Pages OCR'd in an earlier run skip render + OCR
+
+    ocr_engine = LazyOCR()       # Session OCR worker if ApplicationManager started one, otherwise PaddleOCR in-process (loaded on the first page that needs it)
+
+    renderer = TitleBlockRenderer(imgdpi=ocr_dpi_ladder[-1])       # In-process, or a pool of render_workers processes
+
+    dirpath = job_root().as_posix()      # Job-scoped working root (PDFSORTER_JOB_ROOT), the script directory by default
+
+    output_directory = Path(f"{dirpath}/_workingdata_/_indexdataset_/")
+
+    output_directory.mkdir(parents=True, exist_ok=True)     # Create output directory if it doesn't exist
+
+    manifest = load_page_manifest()      # Input PDFs and the global page number each one starts at
+
+    if manifest is None:
+        print(f"{bcolors.FAIL}ERROR: No page manifest found, run PDFcombiner.py first{bcolors.ENDC}")
+        emit_event('error', message="No page manifest found, run PDFcombiner.py first")
+        sys.exit(1)
+
+    dataset = []    # Initialize the dataset
+
+    successcount = 0
+    totalcount = 0
+    total_a_or_g_count = 0
+    total_ocr_errors = 0        # Pages of OCR batches that failed
+    total_drawing_number_count = 0
+    total_resolved_at_dpi = [0] * len(ocr_dpi_ladder)
+
+    for manifest_entry in manifest:
+        file_path = Path(manifest_entry['path'])
+        first_page = manifest_entry['first_page']
+        start_time = time.time()        # Iterating over the files
+
+        try:
+            print("")
+            print(f"{'-' * 25}{bcolors.UNDERLINE}Processing: {file_path.name}{bcolors.ENDC}{'-' * 25}")
+            print("")
+
+            original_pdf_name = file_path.stem
+
+            doc = fitz.open(str(file_path))     # Open the source PDF (never saved, all page edits stay in memory)
+
+            if doc.page_count == 0:
+                print(f"{bcolors.WARNING}Warning: {file_path.name} has no pages, skipping...{bcolors.ENDC}")
+                emit_event('warning', message=f"{file_path.name} has no pages, skipping")
+                doc.close()
+                continue
+
+            file_results = []
+            text_layer_count = 0
+            cache_hit_count = 0
+            cache_keys = {}
+            pending_pages = []          # Pages that still need render + OCR after the text layer / cache pass
+            clips = {}                  # page_num -> title block clip of every pending page
+            signatures = {}             # page_num -> (width, height, rotation) of every pending page
+            methods = {}                # page_num -> how the clip was found
+            tried_methods = {}          # page_num -> every method tried on the page, for fallback_title_block()
+            batcher = OCRBatcher(ocr_engine)       # Batch size follows the engine (ocr_batch_size per OCR instance)
+
+            for page_num in range(doc.page_count):          # Iterating over each page in the opened file
+                page = doc[page_num]
+                signature = templates.signature(page)
+
+                if title_block_locator:
+                    clip, locate_method = templates.locate(page, signature)
+                else:
+                    clip, locate_method = title_block_rect(page), 'default'
+
+                # Vector (CAD) sheets already carry "DRAWING NO:" as real text, reading it is ~100x cheaper than rendering + OCR
+                if text_layer_fast_path:
+                    drawing_number = extract_drawing_number(title_block_text(page, clip))
+                    if not drawing_number and locate_method == 'template':
+                        tried_methods[page_num] = {locate_method}
+                        fallback = fallback_title_block(page, clip, tried_methods[page_num])       # Not the learned layout, full search
+                        if fallback is not None:
+                            clip, locate_method = fallback
+                            drawing_number = extract_drawing_number(title_block_text(page, clip))
+                    methods[page_num] = locate_method
+                    if drawing_number:
+                        if title_block_locator and locate_method != 'template' and number_complete(page, clip, drawing_number):
+                            templates.learn(signature, clip)
+                        file_results.append(dataset_row(original_pdf_name, first_page + page_num, drawing_number))
+                        text_layer_count += 1
+                        printProgressBar(len(file_results) - 1, doc.page_count)
+                        continue
+
+                key = (original_pdf_name, first_page + page_num)
+
+                if ocr_cache is not None:
+                    cache_key = ocr_cache.page_key(page, clip, ladder_tag)
+                    cached = ocr_cache.get(cache_key)
+                    if cached is not None:
+                        file_results.append(ocr_dataset_row(key, cached))
+                        cache_hit_count += 1
+                        printProgressBar(len(file_results) - 1, doc.page_count)
+                        continue
+                    cache_keys[key] = cache_key
+
+                methods[page_num] = locate_method
+                tried_methods.setdefault(page_num, {locate_method})
+                pending_pages.append(page_num)
+                clips[page_num] = clip
+                signatures[page_num] = signature
+
+            # Title block clips straight into memory, rendered ahead while the OCR engine works, lowest DPI first
+            render_wait_start = renderer.wait_time
+            resolved_at_dpi = [0] * len(ocr_dpi_ladder)     # Pages whose drawing number was settled at each DPI
+            ocr_round_pages = pending_pages
+
+            while ocr_round_pages:
+                relocate_pages = []         # Clip read nothing, those get the next clip the locator has and one more round
+                ladder_pages = ocr_round_pages
+
+                for rung, imgdpi in enumerate(ocr_dpi_ladder):
+                    last_rung = rung == len(ocr_dpi_ladder) - 1
+                    escalate_pages = []
+
+                    for page_num, ocr_data, render_error in ocr_pages(renderer, batcher, doc, ladder_pages, imgdpi, clips, original_pdf_name, first_page):
+                        key = (original_pdf_name, first_page + page_num)
+
+                        if render_error is not None:
+                            print(f"{bcolors.FAIL}  Render error on page {page_num + 1} of {file_path.name}: {render_error}{bcolors.ENDC}")
+                            emit_event('warning', message=f"Render error on page {page_num + 1} of {file_path.name}: {render_error}")      # Page stays in the index without a number, not a failed run
+                            file_results.append(ocr_dataset_row(key, None))
+                            cache_keys.pop(key, None)
+                            continue
+
+                        drawing_number, score = ocr_drawing_number_score(ocr_data)
+                        if not last_rung and (drawing_number is None or score < ocr_min_score):
+                            escalate_pages.append(page_num)         # Try again sharper
+                            continue
+
+                        if drawing_number is None and methods[page_num] != 'default':
+                            relocate_pages.append(page_num)
+                            continue
+
+                        file_results.append(dataset_row(original_pdf_name, key[1], drawing_number))
+                        resolved_at_dpi[rung] += 1
+                        if (drawing_number and title_block_locator and methods[page_num] != 'template' and
+                                number_complete(doc[page_num], clips[page_num], drawing_number)):
+                            templates.learn(signatures[page_num], clips[page_num])
+
+                        cache_key = cache_keys.pop(key, None)
+                        if ocr_cache is not None and cache_key is not None and ocr_data is not None:
+                            ocr_cache.put(cache_key, ocr_data, drawing_number)
+
+                        printProgressBar(len(file_results) - 1, doc.page_count)
+
+                    if not escalate_pages:
+                        break
+                    ladder_pages = sorted(escalate_pages)
+
+                ocr_round_pages = []
+                for page_num in sorted(relocate_pages):
+                    key = (original_pdf_name, first_page + page_num)
+                    cache_keys.pop(key, None)       # Cache key was for the first clip
+                    fallback = fallback_title_block(doc[page_num], clips[page_num], tried_methods[page_num])
+                    if fallback is None:
+                        file_results.append(dataset_row(original_pdf_name, key[1], None))      # Nothing else to try
+                        continue
+                    clips[page_num], methods[page_num] = fallback
+                    ocr_round_pages.append(page_num)
+
+            file_results.sort(key=lambda row: row['page_number'])       # Text layer / cache hits come first, put everything back in page order
+            dataset.extend(file_results)
+            ocr_error_count = len(set(batcher.failed_pages))
+            total_ocr_errors += ocr_error_count
+            for row in file_results:
+                emit_event('page', pdf_name=row['pdf_name'], page_number=row['page_number'], drawing_number=row['drawing_number'])
+
+            doc.close()
+
+            # Per-file counters
+            file_pages_processed = len(file_results)
+            drawing_number_count = sum(1 for row in file_results if row['drawing_number'])
+            file_a_or_g_count = sum(1 for row in file_results if row['A_or_G'])
+            total_drawing_number_count += drawing_number_count
+            total_a_or_g_count += file_a_or_g_count
+            total_resolved_at_dpi = [total + count for total, count in zip(total_resolved_at_dpi, resolved_at_dpi)]
+
+            end_time = time.time()
+            file_time = end_time - start_time
+
+            print(f"{bcolors.OKCYAN}Processing time: {file_time:.2f} seconds [{display_time(file_time)}]{bcolors.ENDC}")
+            print(f"Drawing numbers in the document: {drawing_number_count}")
+            print(f"Found {file_a_or_g_count} A_or_G drawing numbers from {file_pages_processed} pages")
+            located_by = [list(methods.values()).count(method) for method in ('template', 'label', 'frame', 'default')]
+            print(f"Title block located by template: {located_by[0]} | label: {located_by[1]} | frame: {located_by[2]} | default crop: {located_by[3]} pages")
+            print(f"Read from text layer: {text_layer_count} pages | OCR cache hits: {cache_hit_count} pages | Sent to OCR: {len(pending_pages)} pages")
+            print(f"Throughput: {file_pages_processed / max(file_time, 1e-9):.2f} pages/sec [{ocr_engine.description} | {renderer.description}]")
+            print(f"OCR waited on rendering: {renderer.wait_time - render_wait_start:.2f} seconds")
+            if ocr_error_count:
+                print(f"{bcolors.FAIL}OCR failed on {ocr_error_count} pages{bcolors.ENDC}")
+            if len(ocr_dpi_ladder) > 1:
+                print(f"Settled per DPI: {' | '.join(f'{dpi} DPI: {count}' for dpi, count in zip(ocr_dpi_ladder, resolved_at_dpi))} | Escalated: {sum(resolved_at_dpi[1:])} pages")
+            print("")
+
+            successcount += 1
+            totalcount += 1
+
+        except Exception as e:
+            print("")
+            print("-" * 75)
+            print(f"{bcolors.FAIL}Error processing {file_path.name}: {str(e)}{bcolors.ENDC}")
+            emit_event('error', message=f"Error processing {file_path.name}: {str(e)}")
+            print("-" * 75)
+            print("")
+
+            if 'doc' in locals():
+                doc.close()
+
+            totalcount += 1
+            continue
+
+        if file_a_or_g_count > 0:
+            write_dataset_csv(output_directory / f"{original_pdf_name}_drawing_numbers_dataset.csv", file_results)
+        else:
+            write_dataset_csv(output_directory / f"{original_pdf_name}_drawing_numbers_dataset_unsorted.csv", file_results)
+
+    combined_data_dir = output_directory / "combined_data"
+    combined_data_dir.mkdir(parents=True, exist_ok=True)
+
+    write_dataset_csv(combined_data_dir / "combined_drawing_numbers_dataset.csv", dataset)
+
+    renderer.close()
+    ocr_engine.close()
+
+    if ocr_cache is not None:
+        print(f"OCR cache: {ocr_cache.hits} hit(s) | {ocr_cache.misses} miss(es)")
+        ocr_cache.close()
+
+    total_time_end = time.time()
+    elapsed_total_time = total_time_end - total_time_start
+
+    print("")
+    print("=" * 75)
+    print(f"{bcolors.OKGREEN}TITLE BLOCK OCR COMPLETE{bcolors.ENDC}")
+    print(f"Processed {successcount} files out of {totalcount} in {elapsed_total_time:.2f} seconds [{display_time(elapsed_total_time)}]")
+    print(f"Total pages processed: {len(dataset)}")
+    print(f"Total A_or_G drawing numbers extracted: {total_a_or_g_count} | out of {total_drawing_number_count} drawing numbers")
+    if total_ocr_errors:
+        print(f"{bcolors.FAIL}OCR failed on {total_ocr_errors} pages{bcolors.ENDC}")
+    if len(ocr_dpi_ladder) > 1:
+        print(f"OCR'd pages settled per DPI: {' | '.join(f'{dpi} DPI: {count}' for dpi, count in zip(ocr_dpi_ladder, total_resolved_at_dpi))}")
+    print("=" * 75)
+
+    emit_event('summary', files=successcount, total_files=totalcount, pages=len(dataset),
+               drawing_numbers=total_drawing_number_count, a_or_g=total_a_or_g_count, ocr_errors=total_ocr_errors, seconds=round(elapsed_total_time, 2))
+
+# -------------------------------- END --------------------------------
+
+if __name__ == "__main__":
+    main()
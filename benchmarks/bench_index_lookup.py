@@ -0,0 +1,90 @@
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+import csv
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from DEdependencies import bcolors
+from DEdependencies import dataset_row
+from DEdependencies import write_dataset_csv
+from DEdependencies import load_drawing_index
+from DEdependencies import normalize_drawing_number
+
+"""
+Benchmark for the drawing number lookup in PDFpageSorter.py / PDFpageSortercsv.py.
+Builds a synthetic index dataset (10k sheets by default) and compares the old lookup, which re-opened the csv
+and scanned it row by row for every drawing, against loading it once with load_drawing_index() and using dict lookups.
+The old lookup is quadratic, so it only runs for --scan-lookups drawings and the full sort time is extrapolated from that.
+
+Usage: python benchmarks/bench_index_lookup.py --sheets 10000 --scan-lookups 200
+"""
+
+# ------------------------- Custom Functions --------------------------
+
+def synthetic_dataset(sheets):
+    """
+    Index rows with unique drawing numbers like A1.0042, a few pages per sheet left without a number
+    """
+    rows = []
+    for page_number in range(1, sheets + 1):
+        drawing_number = None if page_number % 50 == 0 else f"{random.choice('AGMES')}{page_number // 1000}.{page_number:04d}"
+        rows.append(dataset_row("synthetic", page_number, drawing_number))
+    return rows
+
+def scan_lookup(csv_path, drawingno):
+    """
+    The old per-drawing lookup: open the csv and scan it until the first match
+    """
+    with open(csv_path, 'r', newline='', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile, fieldnames=['pdf_name', 'page_number', 'drawing_number', 'A_or_G'])
+        next(reader, None)
+        for row in reader:
+            if row["drawing_number"].strip() == drawingno.strip():
+                return int(row['page_number'])
+    return None
+
+# -------------------------------- END --------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Linear csv scan vs in-memory index for drawing number lookups")
+    parser.add_argument("--sheets", type=int, default=10000, help="Number of pages in the synthetic index")
+    parser.add_argument("--scan-lookups", type=int, default=200, help="Drawings to time with the old linear scan")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    rows = synthetic_dataset(args.sheets)
+    reference_order = [row['drawing_number'] for row in rows if row['drawing_number']]
+    random.shuffle(reference_order)         # The reference list is in a different order than the combined PDF
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = Path(tmpdir) / "combined_drawing_numbers_dataset.csv"
+        write_dataset_csv(csv_path, rows)
+
+        scan_sample = reference_order[:args.scan_lookups]
+        start_time = time.perf_counter()
+        scan_pages = [scan_lookup(csv_path, drawingno) for drawingno in scan_sample]
+        scan_seconds = time.perf_counter() - start_time
+        scan_estimate = scan_seconds / max(len(scan_sample), 1) * len(reference_order)
+
+        start_time = time.perf_counter()
+        drawing_index = load_drawing_index(csv_path)
+        load_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        index_pages = [drawing_index.get(normalize_drawing_number(drawingno), [None])[0] for drawingno in reference_order]
+        lookup_seconds = time.perf_counter() - start_time
+
+    if index_pages[:len(scan_pages)] != scan_pages:
+        print(f"{bcolors.FAIL}Index lookup returned different pages than the linear scan{bcolors.ENDC}")
+        sys.exit(1)
+
+    print(f"Synthetic index: {args.sheets} pages, {len(reference_order)} drawings to sort")
+    print("")
+    print(f"Linear csv scan : {scan_seconds:.3f}s for {len(scan_sample)} lookups -> ~{scan_estimate:.1f}s for the full sort")
+    print(f"In-memory index : {load_seconds:.3f}s to load + {lookup_seconds:.4f}s for {len(reference_order)} lookups")
+    print("")
+    print(f"{bcolors.OKGREEN}Speed-up: ~{scan_estimate / max(load_seconds + lookup_seconds, 1e-9):.0f}x{bcolors.ENDC}")
@@ -0,0 +1,74 @@
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+import time
+import argparse
+import fitz
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from OCRengine import create_ocr_engine
+from OCRengine import ocr_results
+from PDFrender import render_title_block
+from DEdependencies import bcolors
+from DEdependencies import extract_drawing_number
+
+"""
+Benchmark for batched OCR inference (OCRBatcher / ocr_batch_size in config.ini).
+Renders the title block crops of a drawing set once, then pushes the same crops through PaddleOCR on the CPU
+at several batch sizes and reports pages/sec and how many drawing numbers each run found.
+
+Usage: python benchmarks/bench_ocr_batch.py path/to/set.pdf --pages 64 --batch-sizes 1,2,4,8,16
+"""
+
+# ------------------------- Custom Functions --------------------------
+
+def render_crops(pdf_path, max_pages, imgdpi):
+    """
+    Renders the title block clip of the first max_pages pages into BGR arrays (zero-copy views, see PDFrender.py)
+    """
+    crops = []
+    doc = fitz.open(str(pdf_path))
+    for page_num in range(min(max_pages, doc.page_count)):
+        crops.append(render_title_block(doc[page_num], 72, imgdpi))
+    doc.close()
+    return crops
+
+def run_batches(engine, crops, batch_size):
+    """
+    OCRs all crops batch_size at a time, returns (seconds, drawing numbers found)
+    """
+    found = 0
+    start_time = time.perf_counter()
+    for i in range(0, len(crops), batch_size):
+        for ocr_data in ocr_results(engine.predict(crops[i:i + batch_size])):
+            if extract_drawing_number(' '.join(ocr_data['rec_texts'])):
+                found += 1
+    return time.perf_counter() - start_time, found
+
+# -------------------------------- END --------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pages/sec of batched PaddleOCR inference on CPU")
+    parser.add_argument("pdf", help="Drawing set to take title block crops from")
+    parser.add_argument("--pages", type=int, default=64, help="Number of pages to OCR per run")
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16", help="Comma separated batch sizes to compare")
+    parser.add_argument("--dpi", type=int, default=300, help="Render DPI of the crops")
+    args = parser.parse_args()
+
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+
+    crops = render_crops(args.pdf, args.pages, args.dpi)
+    print(f"Rendered {len(crops)} title block crops at {args.dpi} DPI")
+
+    print("")
+    print(f"{'batch':>6} | {'seconds':>8} | {'pages/sec':>9} | {'found':>5}")
+    print("-" * 40)
+
+    for batch_size in batch_sizes:
+        engine = create_ocr_engine(device='cpu', batch_size=batch_size)
+        run_batches(engine, crops[:batch_size], batch_size)        # Warm up so model load / first call isn't timed
+        seconds, found = run_batches(engine, crops, batch_size)
+        print(f"{batch_size:>6} | {seconds:>8.2f} | {len(crops) / seconds:>9.2f} | {found:>5}")
+        del engine
+
+    print("")
+    print(f"{bcolors.OKGREEN}Set ocr_batch_size in config.ini to the fastest batch size{bcolors.ENDC}")
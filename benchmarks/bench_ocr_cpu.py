@@ -0,0 +1,78 @@
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+import time
+import argparse
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from OCRengine import OCRPool
+from OCRengine import available_cores
+from OCRengine import plan_cpu_pool
+from OCRengine import OCR_BATCH_SIZE
+from DEdependencies import bcolors
+from DEdependencies import extract_drawing_number
+from bench_ocr_batch import render_crops
+
+"""
+Benchmark for the CPU OCR path (ocr_device = cpu).
+Runs the same title block crops through pools of pinned PaddleOCR instances with different instances x threads splits
+of the cores, including the single instance that uses every core (the old CPU fallback) and the split plan_cpu_pool() picks.
+Reports pages/sec for each configuration.
+
+Usage: python benchmarks/bench_ocr_cpu.py path/to/set.pdf --pages 128
+"""
+
+# ------------------------- Custom Functions --------------------------
+
+def configurations(cores):
+    """
+    (instances, threads) splits to compare, the auto plan first
+    """
+    configs = [plan_cpu_pool(cores)]
+    for threads in (cores, 8, 4, 2, 1):
+        if threads <= cores:
+            config = (max(1, cores // threads), threads)
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+def run_pool(pool, crops):
+    """
+    OCRs all crops through the pool one full pool batch at a time, returns (seconds, drawing numbers found)
+    """
+    found = 0
+    start_time = time.perf_counter()
+    for i in range(0, len(crops), pool.batch_capacity):
+        for ocr_data in pool.predict(crops[i:i + pool.batch_capacity]):
+            if extract_drawing_number(' '.join(ocr_data['rec_texts'])):
+                found += 1
+    return time.perf_counter() - start_time, found
+
+# -------------------------------- END --------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pages/sec of PaddleOCR instance pools on CPU")
+    parser.add_argument("pdf", help="Drawing set to take title block crops from")
+    parser.add_argument("--pages", type=int, default=128, help="Number of pages to OCR per run")
+    parser.add_argument("--dpi", type=int, default=300, help="Render DPI of the crops")
+    parser.add_argument("--batch-size", type=int, default=OCR_BATCH_SIZE, help="Crops per instance per predict() call")
+    args = parser.parse_args()
+
+    cores = available_cores()
+    crops = render_crops(args.pdf, args.pages, args.dpi)
+    print(f"Rendered {len(crops)} title block crops at {args.dpi} DPI, {cores} CPU core(s) available")
+
+    print("")
+    print(f"{'instances':>9} | {'threads':>7} | {'seconds':>8} | {'pages/sec':>9} | {'found':>5}")
+    print("-" * 52)
+
+    for index, (instances, threads) in enumerate(configurations(cores)):
+        pool = OCRPool(instances, threads, args.batch_size)
+        run_pool(pool, crops[:pool.batch_capacity])       # Warm up so model load / first call isn't timed
+        seconds, found = run_pool(pool, crops)
+        pool.close()
+
+        label = "  <- auto" if index == 0 else ""
+        print(f"{instances:>9} | {threads:>7} | {seconds:>8.2f} | {len(crops) / seconds:>9.2f} | {found:>5}{label}")
+
+    print("")
+    print(f"{bcolors.OKGREEN}Set ocr_cpu_instances / ocr_cpu_threads in config.ini to pin a configuration (0 = auto){bcolors.ENDC}")
@@ -0,0 +1,80 @@
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+import time
+import argparse
+import fitz
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from PDFrender import render_title_block
+from DEdependencies import bcolors
+from DEdependencies import format_bytes
+from DEdependencies import ocr_drawing_number_score
+
+"""
+Benchmark for the OCR render profile (render_profile in config.ini).
+Renders the title blocks of a drawing set as RGB and as single-channel grayscale, reports render time and bytes per crop,
+then (unless --no-ocr) OCRs both sets on the CPU and compares OCR time and how many drawing numbers each one found.
+
+Usage: python benchmarks/bench_render_profile.py path/to/set.pdf --pages 64 --dpi 200
+"""
+
+# ------------------------- Custom Functions --------------------------
+
+def render_profile(doc, page_count, imgdpi, profile):
+    """
+    Renders the first page_count title blocks, returns (crops, seconds)
+    """
+    start_time = time.perf_counter()
+    crops = [render_title_block(doc[page_num], 72, imgdpi, profile) for page_num in range(page_count)]
+    return crops, time.perf_counter() - start_time
+
+def ocr_profile(engine, crops, batch_size):
+    """
+    OCRs the crops, returns (drawing numbers found, seconds)
+    """
+    drawing_numbers = []
+    start_time = time.perf_counter()
+    for i in range(0, len(crops), batch_size):
+        for ocr_data in engine.predict(crops[i:i + batch_size]):
+            drawing_numbers.append(ocr_drawing_number_score(ocr_data)[0])
+    return drawing_numbers, time.perf_counter() - start_time
+
+# -------------------------------- END --------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RGB vs grayscale title block crops: render cost, size, OCR hit rate")
+    parser.add_argument("pdf", help="Drawing set to take title block crops from")
+    parser.add_argument("--pages", type=int, default=64, help="Number of pages to compare")
+    parser.add_argument("--dpi", type=int, default=200, help="Render DPI of the crops")
+    parser.add_argument("--batch-size", type=int, default=8, help="OCR batch size")
+    parser.add_argument("--no-ocr", action="store_true", help="Only compare rendering")
+    args = parser.parse_args()
+
+    doc = fitz.open(args.pdf)
+    page_count = min(args.pages, doc.page_count)
+
+    rendered = {}
+    print(f"{'profile':>7} | {'render s':>8} | {'bytes/crop':>10}")
+    print("-" * 33)
+    for profile in ('rgb', 'gray'):
+        crops, seconds = render_profile(doc, page_count, args.dpi, profile)
+        rendered[profile] = crops
+        print(f"{profile:>7} | {seconds:>8.2f} | {format_bytes(sum(crop.nbytes for crop in crops) / len(crops)):>10}")
+    doc.close()
+
+    if not args.no_ocr:
+        from OCRengine import LocalOCR
+        engine = LocalOCR('cpu')
+        engine.predict(rendered['rgb'][:1])         # Warm up so model load isn't timed
+
+        found = {}
+        print("")
+        print(f"{'profile':>7} | {'OCR s':>8} | {'found':>5}")
+        print("-" * 28)
+        for profile in ('rgb', 'gray'):
+            found[profile], seconds = ocr_profile(engine, rendered[profile], args.batch_size)
+            print(f"{profile:>7} | {seconds:>8.2f} | {sum(1 for number in found[profile] if number):>5}")
+
+        agree = sum(1 for rgb, gray in zip(found['rgb'], found['gray']) if rgb == gray)
+        print("")
+        print(f"{bcolors.OKGREEN}Same drawing number from both profiles on {agree} of {page_count} pages{bcolors.ENDC}")
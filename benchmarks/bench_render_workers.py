@@ -0,0 +1,48 @@
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+import time
+import argparse
+import fitz
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from PDFrender import TitleBlockRenderer
+from DEdependencies import bcolors
+
+"""
+Benchmark for parallel title block rendering (TitleBlockRenderer / render_workers in config.ini).
+Renders the title blocks of a drawing set with 1, 2, 4, ... worker processes and reports pages/sec and the speed-up over in-process rendering.
+Pool start up is timed too, that is what a real run pays once per stage.
+
+Usage: python benchmarks/bench_render_workers.py path/to/set.pdf --workers 1,2,4,8,16,32
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pages/sec of title block rendering per render worker count")
+    parser.add_argument("pdf", help="Drawing set to render")
+    parser.add_argument("--workers", default="1,2,4,8", help="Comma separated worker counts to compare")
+    parser.add_argument("--dpi", type=int, default=300, help="Render DPI of the crops")
+    args = parser.parse_args()
+
+    doc = fitz.open(args.pdf)
+    page_nums = list(range(doc.page_count))
+
+    print(f"Rendering {len(page_nums)} title blocks at {args.dpi} DPI")
+    print("")
+    print(f"{'workers':>7} | {'seconds':>8} | {'pages/sec':>9} | {'speed-up':>8}")
+    print("-" * 44)
+
+    baseline = None
+    for workers in [int(count) for count in args.workers.split(",")]:
+        renderer = TitleBlockRenderer(workers=workers, imgdpi=args.dpi)
+        start_time = time.perf_counter()
+        rendered = sum(1 for _, img, error in renderer.render(doc, page_nums) if img is not None)
+        seconds = time.perf_counter() - start_time
+        renderer.close()
+
+        baseline = baseline or seconds
+        print(f"{workers:>7} | {seconds:>8.2f} | {rendered / seconds:>9.2f} | {baseline / seconds:>7.1f}x")
+
+    doc.close()
+
+    print("")
+    print(f"{bcolors.OKGREEN}Set render_workers in config.ini to where the speed-up flattens out{bcolors.ENDC}")
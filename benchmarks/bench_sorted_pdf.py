@@ -0,0 +1,101 @@
+import sys
+sys.stdout.reconfigure(encoding='utf-8')
+import time
+import random
+import argparse
+import tempfile
+import fitz
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from DEdependencies import bcolors
+from DEdependencies import format_bytes
+from DEdependencies import manifest_page_map
+from DEdependencies import write_sorted_pdf
+
+"""
+Benchmark for writing the sorted PDF (write_sorted_pdf in DEdependencies.py).
+Builds a synthetic drawing set where every sheet shows the same title block (one shared form XObject + font),
+shuffles it in blocks the way a reference list usually reorders a set (whole disciplines move, sheets inside stay in order)
+and compares the old one insert_pdf call per page + plain save against the run-coalesced / select() writer.
+
+Usage: python benchmarks/bench_sorted_pdf.py --pages 2000 --files 1 --block 20
+"""
+
+# ------------------------- Custom Functions --------------------------
+
+def synthetic_set(directory, pages, files):
+    """
+    Writes files PDFs holding pages sheets between them, returns their page manifest
+    """
+    title_block = fitz.open()
+    template = title_block.new_page(width=300, height=100)
+    template.draw_rect(template.rect, color=(0, 0, 0))
+    template.insert_text((10, 30), "ACME ARCHITECTS - PROJECT 1234 - TITLE BLOCK", fontsize=9)
+
+    manifest = []
+    per_file = -(-pages // files)
+    next_page = 1
+    for file_num in range(files):
+        count = min(per_file, pages - (next_page - 1))
+        doc = fitz.open()
+        for page_num in range(count):
+            page = doc.new_page(width=3024, height=2160)
+            page.insert_text((100, 100), f"Sheet {next_page + page_num}", fontsize=40)
+            page.show_pdf_page(fitz.Rect(2700, 2040, 3000, 2140), title_block, 0)       # Same XObject on every sheet
+        path = Path(directory) / f"set_{file_num}.pdf"
+        doc.save(str(path), garbage=3, deflate=True)
+        doc.close()
+        manifest.append({'path': str(path), 'name': path.stem, 'page_count': count, 'first_page': next_page})
+        next_page += count
+
+    title_block.close()
+    return manifest
+
+def per_page_copy(page_numbers, manifest, output_path):
+    """
+    The old writer: one insert_pdf call per sorted page, plain save
+    """
+    page_map = manifest_page_map(manifest)
+    source_docs = {}
+    sorted_doc = fitz.open()
+    for page_num in page_numbers:
+        source_path, page_index = page_map[page_num]
+        if source_path not in source_docs:
+            source_docs[source_path] = fitz.open(source_path)
+        sorted_doc.insert_pdf(source_docs[source_path], from_page=page_index, to_page=page_index)
+    sorted_doc.save(str(output_path))
+    sorted_doc.close()
+    for source_doc in source_docs.values():
+        source_doc.close()
+
+# -------------------------------- END --------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-page insert_pdf vs run-coalesced sorted PDF writer")
+    parser.add_argument("--pages", type=int, default=2000, help="Sheets in the synthetic set")
+    parser.add_argument("--files", type=int, default=1, help="Input files the set is split over (1 takes the select() path)")
+    parser.add_argument("--block", type=int, default=20, help="Sheets that stay together when the order is shuffled")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    blocks = [list(range(start, min(start + args.block, args.pages + 1))) for start in range(1, args.pages + 1, args.block)]
+    random.shuffle(blocks)
+    page_numbers = [page_num for block in blocks for page_num in block]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manifest = synthetic_set(tmpdir, args.pages, args.files)
+        print(f"Synthetic set: {args.pages} sheets in {args.files} file(s), reordered in blocks of {args.block}")
+        print("")
+
+        results = []
+        for label, writer in (("per-page insert_pdf", per_page_copy), ("coalesced runs", write_sorted_pdf)):
+            output_path = Path(tmpdir) / f"sorted_{len(results)}.pdf"
+            start_time = time.perf_counter()
+            writer(page_numbers, manifest, output_path)
+            seconds = time.perf_counter() - start_time
+            results.append(seconds)
+            print(f"{label:>20} | {seconds:>7.2f}s | {format_bytes(output_path.stat().st_size):>10}")
+
+    print("")
+    print(f"{bcolors.OKGREEN}Speed-up: {results[0] / max(results[1], 1e-9):.1f}x{bcolors.ENDC}")
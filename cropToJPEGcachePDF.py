@@ -10,11 +10,18 @@ from DEdependencies import bcolors
 from DEdependencies import get_folder_size_os
 from DEdependencies import format_bytes
 from DEdependencies import printProgressBar
+from DEdependencies import job_root
 from DEdependencies import display_time
+from DEdependencies import load_crop_manifest
 
 """     #2
-This script takes PDFs containing the DRAWING NO: cropped out (through lossless means) and converts them into space-efficient pdfs
-that purge all XREF data, only leaving behind small lossy JPEG images of each cropped page's content which is ready to be OCRed
+This script renders the DRAWING NO: title block of every page listed in the crop manifest (ExpandedPDFdrawingNumberCrop.py)
+straight from the input PDFs into space-efficient pdfs that purge all XREF data, only leaving behind small lossy JPEG images
+of each page's title block which is ready to be OCRed. The input PDFs are only read, there is no cropped copy in between anymore.
+
+Pages flagged flatten in the manifest (MuPDF reported a critical error on that page) are flattened the way flattenPDF() used to do
+whole files: the whole page is rasterized at 300 DPI and the title block clip is cut out of that raster. Only the flagged pages pay for it,
+and a page that can't even be rasterized gets a blank image (and a warning) so the rest of the file still goes through.
 
 Feel free to switch around the quality settings if you're having trouble with OCR image quality imput. I should have an envrionment file
 
@@ -23,101 +30,129 @@ with some kind of terminal-based GUI that handles this.
 
 # ------------------------- Custom Functions --------------------------
 
-def PPP(page, pdfdpi = 72, imgdpi = 300):
+def PPP(page, pdfdpi = 72, imgdpi = 300, clip = None):
     """
     PDF_PAGE_TO_PIL
 
     Converts a PyMuPDF page to a PIL Image for OCR processing. Handles in JPEG (No hate to my PNG fans)
-    
+
     Args:
         page (fitz.Page): PyMuPDF page object
         pdfdpi (int): DPI of the pdf you want to convert from (Defualt is 72 for PyMuPDFs but change however you want)
         imgdpi (int): DPI of the image you want as output (Default is 300 which is really high quality but JPEG saves on storage)
-        
+        clip (fitz.Rect): Area of the page to convert in displayed coordinates, the whole page if None
+
     Returns:
         PIL.Image: PIL Image object ready for OCR processing
     """
     # Create transformation matrix for the specified DPI
     mat = fitz.Matrix(imgdpi/pdfdpi, imgdpi/pdfdpi)
-    
-    # Convert page to pixmap (raster image)
-    pix = page.get_pixmap(matrix=mat)
-    
+
+    # Convert page (or only the clip) to pixmap (raster image)
+    pix = page.get_pixmap(matrix=mat, clip=clip)
+
     # Convert pixmap to PIL Image
     img_data = pix.pil_tobytes(format="JPEG")
     img = Image.open(io.BytesIO(img_data))
-    
+
     return img
 
+def flattened_clip(page, clip, imgdpi = 300):
+    """
+    Rasterizes the whole page and cuts the clip out of the raster, for pages MuPDF reported a critical error on
+
+    Args:
+        page (fitz.Page): PyMuPDF page object
+        clip (fitz.Rect): Title block clip in displayed coordinates
+        imgdpi (int): DPI of the page raster
+
+    Returns:
+        PIL.Image: The clip's part of the page raster
+    """
+    img = PPP(page, 72, imgdpi)     # Same full page raster flattenPDF() made
+
+    clip = clip - (page.rect.x0, page.rect.y0, page.rect.x0, page.rect.y0)     # Relative to the raster's top left corner
+    box = (clip * fitz.Matrix(imgdpi/72, imgdpi/72)).irect      # Same pixel rounding as get_pixmap(clip=)
+    return img.crop(tuple(box))
+
 # -------------------------------- END --------------------------------
 
-dirpath = Path(__file__).parent.as_posix()
+dirpath = job_root().as_posix()      # Job-scoped working root (PDFSORTER_JOB_ROOT), the script directory by default
 
-input_directory = Path(f"{dirpath}/_workingdata_/_bloatedcache_")       # For iterating over all the files
 output_directory = Path(f"{dirpath}/_workingdata_/_pdfcache_/")      # Put the finished files here
 
 output_directory.mkdir(parents=True, exist_ok=True)     # Create output directory if it doesn't exist
 
-file_paths = [f for f in input_directory.iterdir() if f.suffix.lower() == '.pdf' and f.stem.endswith('-drawingno')]     # Get all cropped PDF files (ending with -drawingno.pdf)
+crop_files = load_crop_manifest()       # Input PDFs and the title block clip of each of their pages
+if crop_files is None:
+    print(f"{bcolors.FAIL}No crop manifest found, run ExpandedPDFdrawingNumberCrop.py first{bcolors.ENDC}")
+    sys.exit(1)
 
-input_directory_size = get_folder_size_os(input_directory)
+input_directory_size = sum(os.path.getsize(crop_file['path']) for crop_file in crop_files if os.path.exists(crop_file['path']))
 
 successcount = 0
 totalcount = 0
 
 total_time_start = time.time()
 
-for file_path in file_paths:
+for crop_file in crop_files:
     start_time = time.time()
+    file_path = Path(crop_file['path'])
     try:
         print("")
         print(f"{'-' * 25}{bcolors.UNDERLINE}Processing: {file_path.name}{bcolors.ENDC}{'-' * 25}")
         print("")
 
-        doc = fitz.open(str(file_path))     # Open the cropped PDF
-        
-        if doc.page_count == 0:
+        doc = fitz.open(str(file_path))     # Open the input PDF, read only
+
+        if not crop_file['pages']:
             print(f"{bcolors.WARNING}Warning: {file_path.name} has no pages, skipping...{bcolors.ENDC}")
             doc.close()
             continue
 
         image_pdf = fitz.open()     # Create a new PDF to store images
 
-        for page_num in range(doc.page_count):
-            page = doc[page_num]
-            
-            img = PPP(page,72,300)
-            
+        for i, crop_page in enumerate(crop_file['pages']):
+            page = doc[crop_page['page']]
+
+            if page.rotation != crop_page['rotation']:
+                print(f"{bcolors.WARNING}Warning: page {crop_page['page'] + 1} of {file_path.name} changed rotation since it was cropped{bcolors.ENDC}")
+
+            clip = fitz.Rect(crop_page['clip'])
+            if crop_page['flatten']:
+                try:
+                    img = flattened_clip(page, clip, 300)
+                except Exception as e:
+                    print(f"{bcolors.WARNING}Warning: page {crop_page['page'] + 1} of {file_path.name} could not be flattened, left blank: {e}{bcolors.ENDC}")
+                    img = Image.new("RGB", (max(1, round(clip.width * 300 / 72)), max(1, round(clip.height * 300 / 72))), "white")
+            else:
+                img = PPP(page, 72, 300, clip)
+
             img_width, img_height = img.size    # Create a new page in the output PDF with the same dimensions as the image
 
             page_width = img_width * 72 / 300    # Convert pixels to points
             page_height = img_height * 72 / 300  # Convert pixels to points
-            
+
             new_page = image_pdf.new_page(width=page_width, height=page_height)
-            
+
             # Insert the image into the new page
             img_bytes = io.BytesIO()
             img.save(img_bytes, format='JPEG')
             img_bytes.seek(0)
-            
+
             # Insert image to fill the entire page
             rect = fitz.Rect(0, 0, page_width, page_height)
             new_page.insert_image(rect, stream=img_bytes)
 
-            printProgressBar(page_num,doc.page_count)       # Live progress update in terminal
-        
+            printProgressBar(i, len(crop_file['pages']))       # Live progress update in terminal
 
-
-        original_name = file_path.stem.replace('-drawingno', '')        # Remove the -drawingno suffix
-        output_filename = f"{original_name}-drawingnoimage.pdf"         # add -drawingnoimage
+        output_filename = f"{crop_file['name']}-drawingnoimage.pdf"         # add -drawingnoimage
         output_path = output_directory / output_filename
-        
+
         image_pdf.save(str(output_path))        # Save the new PDF with images
         image_pdf.close()
         doc.close()
 
-        os.remove(str(file_path))          # Get rid of the large file
-
         end_time = time.time()
         file_time = end_time - start_time
 
@@ -128,8 +163,8 @@ for file_path in file_paths:
 
         successcount += 1
         totalcount += 1
-    
-    
+
+
 
     except Exception as e:
         print("")
@@ -137,12 +172,12 @@ for file_path in file_paths:
         print(f"{bcolors.FAIL}Error processing {file_path.name}: {str(e)}{bcolors.ENDC}")
         print("-" * 75)
         print("")
-        
+
         if 'doc' in locals():
             doc.close()
         if 'image_pdf' in locals():
             image_pdf.close()
-        
+
         totalcount += 1
         continue
 
@@ -151,12 +186,12 @@ elapsed_total_time = total_time_end - total_time_start
 
 if successcount == totalcount:
     print(f"{bcolors.OKGREEN}SUCCESSFULLY CONVERTED {successcount} CROPPED PDF(S) OUT OF {totalcount} CROPPED PDF(S) IN {elapsed_total_time:.2f} SECOND(S) [{display_time(elapsed_total_time)}]{bcolors.ENDC}")
-    print(f"{bcolors.OKGREEN}Input directory size: {format_bytes(input_directory_size)} | Output directory size: {format_bytes(get_folder_size_os(output_directory))} {bcolors.ENDC}")
+    print(f"{bcolors.OKGREEN}Input PDF(s) size: {format_bytes(input_directory_size)} | Output directory size: {format_bytes(get_folder_size_os(output_directory))} {bcolors.ENDC}")
 
 elif 0 < successcount < totalcount:
     print(f"{bcolors.WARNING}WARNING: ALL PDFS COULD NOT BE CROPPED{bcolors.ENDC}")
     print(f"{bcolors.WARNING}SUCCESSFULLY CONVERTED {successcount} CROPPED PDF(S) OUT OF {totalcount} CROPPED PDF(S) IN {elapsed_total_time:.2f} SECOND(S) [{display_time(elapsed_total_time)}]{bcolors.ENDC}")
-    print(f"{bcolors.WARNING}Input directory size: {format_bytes(input_directory_size)} | Output directory size: {format_bytes(get_folder_size_os(output_directory))} {bcolors.ENDC}")
+    print(f"{bcolors.WARNING}Input PDF(s) size: {format_bytes(input_directory_size)} | Output directory size: {format_bytes(get_folder_size_os(output_directory))} {bcolors.ENDC}")
 
 else:
-    print(f"{bcolors.FAIL}UNABLE TO CACHE ANY PDF(S) from the DIRECTORY{bcolors.ENDC}")
\ No newline at end of file
+    print(f"{bcolors.FAIL}UNABLE TO CACHE ANY PDF(S) from the DIRECTORY{bcolors.ENDC}")